@@ -2,6 +2,7 @@ from app.core.router_decorated import APIRouter
 from fastapi import status
 from app.schemas.my_base_model import CustormBaseModel
 from typing import List
+from app.core.local_cache import local_cache
 
 router = APIRouter()
 # REQUIREMENTS FOR MODEL DEFINITION 
@@ -36,3 +37,16 @@ async def get_health() -> HealthCheck:
 
 from app.schemas.auth import Proflies, BaseUser
 from app.schemas.my_base_model import Message
+
+@router.get(
+    "/health/cache",
+    tags=["healthcheck"],
+    summary="In-process cache stats",
+    status_code=status.HTTP_200_OK,
+)
+async def get_cache_health() -> dict:
+    """
+    ## In-process (L1) cache stats of the worker serving this request
+    Returns hits, misses, hit ratio, evictions, number of entries and memory use in bytes
+    """
+    return local_cache.stats()
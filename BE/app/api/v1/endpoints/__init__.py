@@ -1 +1 @@
-from app.api.v1.endpoints import al_trade, search, ai_analysis, prices
\ No newline at end of file
+from app.api.v1.endpoints import al_trade, search, ai_analysis, prices, admin
\ No newline at end of file
@@ -0,0 +1,50 @@
+from app.core.router_decorated import APIRouter
+from fastapi import Depends
+# module import: app.core.cache import the endpoints to register the cached routers
+import app.core.cache as cache
+from app.core.cache_stats import cache_stats
+from app.core.local_cache import local_cache
+from app.core.redis_client import get_redis, breaker
+from app.core.security import doc_auth
+from app.db.session import get_pool_stats
+
+router = APIRouter()
+group_tags=["Admin"]
+
+
+@router.get("/cache",
+            tags=group_tags)
+async def get_cache_stats(username: str = Depends(doc_auth)) -> dict:
+    """ Cache analytics per cached route
+    - hits, stale_hits, misses, hit_ratio, sets, set_failures, lookup latency, payload bytes: counters of the worker serving this request (pid)
+    - live_keys: unexpired redis keys of the route, shared by every worker
+    - l1: in-process cache of this worker
+    - redis: circuit breaker state of this worker (closed | open | half-open)
+    - db: connection pool gauges of the primary and each replica in this worker (checked out, overflow, checkout wait)
+    """
+    cache_types = {}
+    for method in ('GET', 'POST'):
+        for route_key, cache_type in {**cache.CACHE_PATHS[method], **cache.CACHE_PATHS[method+'-MATCH']}.items():
+            cache_types[route_key] = cache_type
+    try:
+        live_keys = await breaker.call(lambda: cache_stats.live_keys(get_redis(), list(cache.CACHE_KEYS)))
+    except Exception as e:  # redis unavailable
+        print("Failed to count cache keys", e)
+        live_keys = {}
+
+    worker = cache_stats.to_dict()
+    routes = {}
+    for route_key in cache.CACHE_KEYS:
+        routes[route_key] = {
+            'cache_type': cache_types.get(route_key),
+            'live_keys': live_keys.get(route_key),
+            **worker['routes'].get(route_key, {}),
+        }
+    return {
+        'pid': worker['pid'],
+        'uptime': worker['uptime'],
+        'l1': local_cache.stats(),
+        'redis': breaker.to_dict(),
+        'db': get_pool_stats(),
+        'routes': routes,
+    }
@@ -1,4 +1,4 @@
-import re, os
+import re, os, json, base64
 os.environ['TZ'] = 'UTC'
 
 from starlette.requests import Request
@@ -7,12 +7,11 @@ import app.schemas.sub_info as schemas
 from app.core.config import settings
 from app.core.router_decorated import APIRouter
 from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from app.db.session import get_db
+from app.db.session import get_async_db
+from app.db.queries import get_query
 from datetime import datetime
-import pandas as pd
 
 router = APIRouter()
 SCHEMA = settings.SCHEMA_2 + "."
@@ -20,50 +19,72 @@ TOKEN_TABLE = SCHEMA + "token"
 group_tags=["Trade-bot"]
 
 
-def get_trades(id:str, status:str, start_time:int=None,offset:int=0, limit:int=100 , db:Session=get_db()) -> List:
-    time_cond = f" and entry_time > {start_time}" if start_time else ""
+# hard page size of every trade list, and max depth of the open positions offset
+MAX_LIMIT = 100
+MAX_OFFSET = 1000
+
+
+def encode_cursor(row) -> str:
+    """ opaque cursor of the page after `row`: its (exit_time, id)
+    """
+    data = json.dumps([row.exit_time, row.id], default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        exit_time, trade_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return exit_time, trade_id
+
+
+async def get_trades(id:str, status:str, start_time:int=None, offset:int=0, limit:int=100, cursor:str=None, db:AsyncSession=None) -> tuple[List, str | None]:
+    """ one page of trades of a bot and the cursor of the next page (closed trades only, None on the last page)
+    - open: newest entry first, offset paging (few open positions per bot)
+    - closed: newest exit first, keyset paging on (exit_time, id), same cost at any depth
+    """
+    limit = min(max(1, limit), MAX_LIMIT)
+    params = {'bot_id': id, 'start_time': start_time or None}
     if status == 'open':
-        sql = f"""
-        SELECT  a.token, a.direction, a.entry_price, b.price current_price, a.position_size, a.invested_amount, a.position_size*b.price current_value, a.entry_time
-        from (
-            SELECT pair, LEFT(pair, char_length(pair)-4) token, direction, entry_price, exit_price, invested_amount, net_return, profit, position_size, entry_time, exit_time 
-            FROM trade_bot.trades t 
-            where bot_id='{id}' and status='open' {time_cond}
-            limit {limit} offset {offset}
-        ) a left join (
-            select symbol, price
-            from (
-                select symbol, price, open_time,
-                    row_number() over (partition by symbol order by open_time desc) r
-                from(
-                    select symbol, `close` as price, open_time 
-                    from proddb.coin_prices_5m cpm 
-                    where open_time > UNIX_TIMESTAMP(NOW()) - 1800  -- 30 p
-                ) b
-            ) b
-            where r=1
-        ) b on b.symbol = a.pair
-        """
+        query = get_query('bot_open_trades')
+        params.update(limit=limit, offset=min(max(0, offset), MAX_OFFSET))
     else:
-        sql = f"""
-        SELECT LEFT(pair, char_length(pair)-4) token, direction, entry_price, exit_price, invested_amount, net_return, profit, position_size, entry_time, exit_time 
-        FROM trade_bot.trades t 
-        where bot_id="{id}" and status='closed' {time_cond}
-        """
+        cursor_time, cursor_id = decode_cursor(cursor) if cursor else (None, None)
+        query = get_query('bot_closed_trades')
+        params.update(limit=limit + 1, cursor_time=cursor_time, cursor_id=cursor_id)  # one more row: is there a next page
     result = []
     try:
-        result = db.execute(text(sql)).fetchall()
+        result = (await db.execute(query, params)).fetchall()
     except Exception as e:
         print("error:", e)
-    return result
+    next_cursor = None
+    if status != 'open' and len(result) > limit:
+        result = result[:limit]
+        next_cursor = encode_cursor(result[-1])
+    return result, next_cursor
+
+
+def closed_trade(row) -> dict:
+    return {
+        'token': row.token,
+        'direction': row.direction,
+        'entry_price': row.entry_price,
+        'exit_price': row.exit_price,
+        'position_size': row.position_size,
+        'profit': row.profit,
+        'invested_amount': row.invested_amount,
+        'entry_time': row.entry_time,
+        'exit_time': row.exit_time
+    }
 
 
 @router.get("/bot/{id}/open_pos",
             tags=group_tags,
             # response_model=List[schemas.Blockchain]
             )
-def bot_open_pos(id:str,offset:int=0, limit:int=100, db: Session = Depends(get_db)):
-    res = get_trades(id, 'open', None, offset, limit, db)
+async def bot_open_pos(id:str,offset:int=0, limit:int=100, db: AsyncSession = Depends(get_async_db)):
+    res, _ = await get_trades(id, 'open', None, offset, limit, db=db)
     result = []
     try:
         for row in res:
@@ -87,46 +108,43 @@ def bot_open_pos(id:str,offset:int=0, limit:int=100, db: Session = Depends(get_d
             tags=group_tags,
             # response_model=schemas.Token
             )
-def bot_trade_history(id:str, start_time:int=None, offset:int=0, limit:int=100, db: Session = Depends(get_db)) -> List:
+async def bot_trade_history(id:str, start_time:int=None, cursor:str=None, limit:int=100, db: AsyncSession = Depends(get_async_db)) -> dict:
+    """
+    PARAM:
+    - start_time: unix secs, trades entered after it, default 30 days ago
+    - cursor: next_cursor of the previous page, empty for the first page
+    - limit: trades per page, max 100
+    """
     start_time = start_time or int(datetime.now().timestamp()) - 86400 * 30 # 30 days
-    res = get_trades(id, 'closed', start_time, offset, limit, db)
-    result = []
-    try:
-        for row in res:
-            result.append({
-                'token': row.token,
-                'direction': row.direction,
-                'entry_price': row.entry_price,
-                'exit_price': row.exit_price,
-                'position_size': row.position_size,
-                'profit': row.profit,
-                'invested_amount': row.invested_amount,
-                'entry_time': row.entry_time,
-                'exit_time': row.exit_time
-            })
-    except Exception as e:
-        print("error:", e)
-    return result
+    res, next_cursor = await get_trades(id, 'closed', start_time, limit=limit, cursor=cursor, db=db)
+    return {
+        'trades': [closed_trade(row) for row in res],
+        'next_cursor': next_cursor,
+    }
 
 @router.get("/bot/{id}/summary",
             tags=group_tags,
             # response_model=schemas.Token
             )
-def bot_trade_summary(id:str, start_time:int=None,offset:int=0, limit:int=100, db: Session = Depends(get_db)):
+async def bot_trade_summary(id:str, start_time:int=None, cursor:str=None, limit:int=100, db: AsyncSession = Depends(get_async_db)):
+    """ totals of every closed trade since start_time (default 30 days ago) and one page of them
+    """
     start_time = start_time or int(datetime.now().timestamp()) - 86400 * 30 # 30 days
-    data = pd.DataFrame(get_trades(id, 'closed', start_time, offset, limit, db),
-                        columns=['token', 'direction', 'entry_price', 'exit_price', 'invested_amount', 'net_return', 'profit', 'position_size', 'entry_time', 'exit_time'])
-    profit = data['profit'].sum()
+    params = {'bot_id': id, 'start_time': start_time}
+    try:
+        totals = (await db.execute(get_query('bot_closed_summary'), params)).one()
+    except Exception as e:
+        print("error:", e)
+        raise HTTPException(status_code=500, detail="Query data error")
+    res, next_cursor = await get_trades(id, 'closed', start_time, limit=limit, cursor=cursor, db=db)
 
-    win = len(data[data['profit'] >= 0])
-    loss = len(data[data['profit'] < 0])
-    
+    win, loss = int(totals.wins), int(totals.losses)
     result = {
-        'win_rate':win / (win+loss)*100, 
-        'total_profit': profit, 
+        'win_rate': win / (win+loss)*100 if win + loss else 0,
+        'total_profit': float(totals.total_profit),
         'wining_trades': win,
         'losing_trades': loss,
-        'trades': data.to_dict('records'),
+        'trades': [{**closed_trade(row), 'net_return': row.net_return} for row in res],
+        'next_cursor': next_cursor,
     }
     return result
-
@@ -3,34 +3,23 @@ from app.core.config import settings
 import app.schemas.ai_analysis as schemas
 from app.core.router_decorated import APIRouter
 from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
-from app.db.session import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict
+from app.db.session import get_read_db
+from app.db.queries import get_query
+from app.db.snapshots import read_snapshot
 
 router = APIRouter()
-SCHEMA = settings.SCHEMA_1 + "."
 group_tags=["Api-v1"]
+# max symbols of a batch request
+MAX_BATCH_SYMBOLS = 100
 
 
 @router.get("/get-predictions",
             tags=group_tags,
             response_model=List[schemas.Prediction])
-def get_latest_predictions(db: Session = Depends(get_db)) -> List[schemas.Prediction]:
-    query = f"""
-        SELECT 
-            symbol, 
-            open_time + interval 2 hour as date,  -- Price is predicted for the end of the next session, mean open_time + 2*period = predicted time
-            last_price as price, 
-            next_pred as prediction,
-            ((next_pred - last_price) / last_price) * 100 AS change_percentage
-        FROM 
-            {SCHEMA}coin_predictions cp 
-        WHERE 
-            open_time = (SELECT MAX(open_time) FROM {SCHEMA}coin_predictions where last_price <> 0)
-            and last_price <> 0
-    """
-    result = db.execute(text(query)).fetchall()
+async def get_latest_predictions(db: AsyncSession = Depends(get_read_db)) -> List[schemas.Prediction]:
+    result = (await db.execute(get_query('latest_predictions'))).fetchall()
     if not result:
         raise HTTPException(status_code=404, detail="No data found")
     # print(result)
@@ -63,7 +52,7 @@ def get_latest_predictions(db: Session = Depends(get_db)) -> List[schemas.Predic
 @router.get("/predict-validate", 
             tags=group_tags,
             response_model=schemas.Validate)
-def validate(time: str=None, db: Session = Depends(get_db)) -> schemas.Validate:
+async def validate(time: str=None, db: AsyncSession = Depends(get_read_db)) -> schemas.Validate:
     """Get the validation of the prediction from given time to now
     - time: str: time to get, format "YYYY-MM-DD HH:MM:SS". if empty or invalid, get the last 30 days 
     """
@@ -80,52 +69,9 @@ def validate(time: str=None, db: Session = Depends(get_db)) -> schemas.Validate:
     if not time_check:
         time = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
 
-    query = f"""
-        SELECT
-            avg(err) as mae,
-            avg(err_on_atr) as avg_err_rate,
-            avg(true_pred) as accuracy,
-            count(1) as n_trade,
-            sum(true_pred) as true_pred,
-            count(1) - sum(true_pred) as false_pred,
-            GREATEST(max(profit_rate) - 1, 0) as max_profit_rate,
-            GREATEST(1 - min(profit_rate), 0) as max_loss_rate,
-            avg(profit_rate) - 1 as avg_profit_rate
-        from(
-            SELECT p.symbol, r.open_time,
-                (p.next_pred - r.close) as err,
-                abs(p.next_pred - r.close)/r.atr14 as err_on_atr,  -- sai so tren bien dong thi truong
-                CASE WHEN p.pred_direction=r.direction THEN 1 ELSE 0 END as true_pred,
-                case 
-                    when p.pred_direction='up' then r.close / p.last_price
-                    when p.pred_direction='down' then p.last_price / r.close
-                    else 1
-                end as profit_rate
-            from(
-                SELECT symbol, (open_time + interval 1 hour) as open_time, last_price, next_pred,
-                case 
-                    when next_pred - last_price > 0 then 'up'
-                    when next_pred - last_price < 0 then 'down'
-                    else 'flat'
-                end as pred_direction
-                FROM {SCHEMA}coin_predictions cp 
-                WHERE open_time >= '{time}'
-                order by open_time desc
-            ) p
-            inner join(
-                SELECT symbol, open, close, atr14, open_time,
-                case 
-                    when c_diff_p - c_diff_n > 0 then 'up'
-                    when c_diff_p - c_diff_n < 0 then 'down'
-                    else 'flat'
-                end as direction
-                from {SCHEMA}f_coin_signal_1h fcsh 
-                where open_time >= '{time}'
-                order by open_time desc
-            ) r on r.open_time = p.open_time and r.symbol = p.symbol
-        ) a
-    """
-    result = db.execute(text(query)).fetchall()
+    # partial sums per symbol per hour, the join of the source tables if the rollup is not built
+    result = await read_snapshot(db, 'snap_predict_validate', {'time': time}) \
+        or (await db.execute(get_query('predict_validate'), {'time': time})).fetchall()
     if not result or len(result) <= 0:
         raise HTTPException(status_code=404, detail="No data found")
     row = result[0]
@@ -141,10 +87,82 @@ def validate(time: str=None, db: Session = Depends(get_db)) -> schemas.Validate:
             false_pred=row.false_pred
         )
 
+def parse_symbols(symbols: str) -> List[str]:
+    """ "BTCVNST, ETHVNST" -> unique symbols, max MAX_BATCH_SYMBOLS
+    """
+    result = list(dict.fromkeys(symbol.strip() for symbol in symbols.split(',') if symbol.strip()))
+    if not result or len(result) > MAX_BATCH_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"symbols must list 1 to {MAX_BATCH_SYMBOLS} symbols")
+    return result
+
+
+# declared before /predict-validate/{symbol}, else "batch" is taken for a symbol
+@router.get("/predict-validate/batch",
+            tags=group_tags,
+            response_model=Dict[str, schemas.Validate])
+async def validate_batch(symbols: str, n_predict: int=1000, db: AsyncSession = Depends(get_read_db)) -> Dict[str, schemas.Validate]:
+    """Validation of the predictions of many coins in one request, same metrics as /predict-validate/{symbol}
+    - symbols: str: comma separated coin symbols, max 100
+    - n_predict: int: number of prediction to validate per coin max 1000, min 1 \n
+    OUTPUT: symbol -> Validate, symbols without data are left out
+    """
+    n_predict = min(max(1, n_predict), 1000)
+    time = (datetime.now() - timedelta(hours=n_predict+5)).strftime('%Y-%m-%d %H:%M:%S')
+    query = get_query('predict_validate_batch')
+    result = (await db.execute(query, {'symbols': parse_symbols(symbols), 'time': time, 'n_predict': n_predict})).fetchall()
+    if not result:
+        raise HTTPException(status_code=404, detail="No data found")
+    return {
+        row.symbol: schemas.Validate(
+            mae=row.mae,
+            avg_err_rate=row.avg_err_rate,
+            max_profit_rate=row.max_profit_rate,
+            max_loss_rate=row.max_loss_rate,
+            avg_profit_rate=row.avg_profit_rate,
+            accuracy=row.accuracy,
+            n_trade=row.n_trade,
+            true_pred=row.true_pred,
+            false_pred=row.false_pred
+        )
+        for row in result
+    }
+
+
+@router.get("/predict-validate/batch/chart",
+            tags=group_tags,
+            response_model=Dict[str, List[schemas.BackTest]])
+async def get_predict_chart_batch(symbols: str, n_predict: int=1000, db: AsyncSession = Depends(get_read_db)) -> Dict[str, List[schemas.BackTest]]:
+    """ Prediction compare history of many coins in one request, same rows as /predict-validate/{symbol}/chart
+    symbols: str: comma separated coin symbols, max 100
+    OUTPUT: symbol -> list of BackTest, symbols without data are left out
+    """
+    n_predict = min(max(1, n_predict), 1000)
+    time = (datetime.now() - timedelta(hours=n_predict+5)).strftime('%Y-%m-%d %H:%M:%S')
+    query = get_query('predict_chart_batch')
+    result = (await db.execute(query, {'symbols': parse_symbols(symbols), 'time': time, 'n_predict': n_predict})).fetchall()
+    if not result:
+        raise HTTPException(status_code=404, detail="No data found")
+    data = {}
+    for row in result:
+        data.setdefault(row.symbol, []).append(
+            schemas.BackTest(
+                symbol=row.symbol,
+                open_time=row.open_time,
+                close_time=row.close_time,
+                close_predict=row.close_predict,
+                open=row.open,
+                close=row.close,
+                high=row.high,
+                low=row.low
+            )
+        )
+    return data
+
+
 @router.get("/predict-validate/{symbol}", 
             tags=group_tags,
             response_model=schemas.Validate)
-def validate_detail(symbol: str, n_predict: int=1000, db: Session = Depends(get_db)) -> schemas.Validate:
+async def validate_detail(symbol: str, n_predict: int=1000, db: AsyncSession = Depends(get_read_db)) -> schemas.Validate:
     """Get the validation of the prediction of a coin 
     - symbol: str: coin symbol
     - n_predict: int: number of prediction to validate max 1000, min 1 \n
@@ -162,53 +180,8 @@ def validate_detail(symbol: str, n_predict: int=1000, db: Session = Depends(get_
     elif n_predict < 1:
         n_predict = 1
     time = (datetime.now() - timedelta(hours=n_predict+5)).strftime('%Y-%m-%d %H:%M:%S')
-    query = f"""
-        SELECT
-            avg(err) as mae,
-            avg(err_on_atr) as avg_err_rate,
-            avg(true_pred) as accuracy,
-            count(1) as n_trade,
-            sum(true_pred) as true_pred,
-            count(1) - sum(true_pred) as false_pred,
-            GREATEST(max(profit_rate) - 1, 0) as max_profit_rate,
-            GREATEST(1 - min(profit_rate), 0) as max_loss_rate,
-            avg(profit_rate) - 1 as avg_profit_rate
-        from(
-            SELECT p.symbol, r.open_time,
-                (p.next_pred - r.close) as err,
-                abs(p.next_pred - r.close)/r.atr14 as err_on_atr,  -- sai so tren bien dong thi truong
-                CASE WHEN p.pred_direction=r.direction THEN 1 ELSE 0 END as true_pred,
-                case 
-                    when p.pred_direction='up' then r.close / p.last_price
-                    when p.pred_direction='down' then p.last_price / r.close
-                    else 1
-                end as profit_rate
-            from(
-                SELECT symbol, (open_time + interval 1 hour) as open_time, last_price, next_pred,
-                case 
-                    when next_pred - last_price > 0 then 'up'
-                    when next_pred - last_price < 0 then 'down'
-                    else 'flat'
-                end as pred_direction
-                FROM {SCHEMA}coin_predictions cp 
-                WHERE symbol = '{symbol}' and open_time >= '{time}'
-                order by open_time desc
-            ) p
-            inner join(
-                SELECT symbol, open, close, atr14, open_time,
-                case 
-                    when c_diff_p > 0 then 'up'
-                    when c_diff_n > 0 then 'down'
-                    else 'flat'
-                end as direction
-                from {SCHEMA}f_coin_signal_1h fcsh 
-                where symbol = '{symbol}' and open_time >= '{time}'
-                order by open_time desc
-            ) r on r.open_time = p.open_time
-            limit {n_predict}
-        ) a
-    """
-    result = db.execute(text(query)).fetchall()
+    query = get_query('predict_validate_symbol')
+    result = (await db.execute(query, {'symbol': symbol, 'time': time, 'n_predict': n_predict})).fetchall()
     if not result or len(result) <= 0:
         raise HTTPException(status_code=404, detail="No data found")
     row = result[0]
@@ -228,7 +201,7 @@ def validate_detail(symbol: str, n_predict: int=1000, db: Session = Depends(get_
 @router.get("/predict-validate/{symbol}/chart",
             tags=group_tags,
             response_model=List[schemas.BackTest])
-def get_predict_chart(symbol: str, n_predict: int=1000, db: Session = Depends(get_db)) -> List[schemas.BackTest]:
+async def get_predict_chart(symbol: str, n_predict: int=1000, db: AsyncSession = Depends(get_read_db)) -> List[schemas.BackTest]:
     """ Get the prediction compare history of a coin
     symbol: str: coin symbol
     start_time: str: start time to get, format "YYYY-MM-DD HH:MM:SS". if empty or invalid, get the last 24 hours 
@@ -238,30 +211,8 @@ def get_predict_chart(symbol: str, n_predict: int=1000, db: Session = Depends(ge
     elif n_predict < 1:
         n_predict = 1
     time = (datetime.now() - timedelta(hours=n_predict+5)).strftime('%Y-%m-%d %H:%M:%S')
-    query = f"""
-        SELECT p.symbol, r.open_time,
-            (r.open_time + interval 1 hour) as close_time,
-            p.next_pred as close_predict,
-            r.open,
-            r.close,
-            r.high,
-            r.low
-        from(
-            SELECT symbol, (open_time + interval 1 hour) as open_time, next_pred
-            FROM {SCHEMA}coin_predictions cp 
-            WHERE symbol = '{symbol}' and open_time >= '{time}'
-            order by open_time desc
-            limit {n_predict}
-        ) p
-        inner join(
-            SELECT symbol, open, close, high, low, open_time
-            from {SCHEMA}f_coin_signal_1h fcsh 
-            where symbol = '{symbol}' and open_time >= '{time}'
-            order by open_time desc
-            limit {n_predict}
-        ) r on r.open_time = p.open_time
-    """
-    result = db.execute(text(query)).fetchall()
+    query = get_query('predict_chart')
+    result = (await db.execute(query, {'symbol': symbol, 'time': time, 'n_predict': n_predict})).fetchall()
     if not result:
         raise HTTPException(status_code=404, detail="No data found")
     return [
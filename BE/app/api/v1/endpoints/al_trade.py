@@ -4,58 +4,33 @@ from app.core.config import settings
 
 from app.core.router_decorated import APIRouter
 from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from app.db.session import get_db
+from app.db.session import get_read_db
+from app.db.queries import get_query, signal_table, pattern_table, rsi_column, PATTERN_TABLES
+from app.db.snapshots import read_snapshot
 from app.utils import str_to_list, str_to_list2d
+from app.core.market_store import market_store
 
 router = APIRouter()
-SCHEMA = settings.SCHEMA_1 + "."
 group_tags=["Api-v1"]
 
 @router.get("/top-over-sold",
             tags=group_tags,
             response_model=List[schemas.HeatMap])
-def get_tos(heatMapType: str, timeType: str, db: Session = Depends(get_db)):
+async def get_tos(heatMapType: str, timeType: str, db: AsyncSession = Depends(get_read_db)):
     """
     PARAM:
     - heatMapType: RSI Window example RSI7 | RSI14
     - timeType: FOUR_HOUR | ONE_HOUR | THIRTY_MINUTE | ONE_DAY
     """
-    if heatMapType not in ("RSI7", "RSI14"):
-        heatMapType = "RSI7"
-
-    if timeType == "FOUR_HOUR":
-        table_name = "f_coin_signal_4h"
-    elif timeType == "ONE_HOUR":
-        table_name = "f_coin_signal_1h"
-    elif timeType == "THIRTY_MINUTE":
-        table_name = "f_coin_signal_30m"
-    else:
-        table_name = "f_coin_signal_1d"
-    rsi_period = heatMapType.lower()
+    heatMapType = heatMapType.strip().upper()
+    timeType = timeType.strip().upper()
 
-    query = f"""
-        select symbol, {rsi_period} as rsi, close, low, high, update_time as date_created
-        from {SCHEMA}{table_name}
-        where {rsi_period} is not null
-        and {rsi_period} < 30
-        and symbol like '%VNST'
-        and open_time = (
-            select max(open_time) as open_time
-            from (
-                select open_time, count(symbol) as num
-                from {SCHEMA}{table_name}
-                where open_time >= now() - interval 7 day
-                group by open_time
-            ) d
-            where d.num > 0
-        )
-        order by {rsi_period} asc
-        limit 100;
-    """
-    result = db.execute(text(query)).fetchall()
+    table, rsi = signal_table(timeType), rsi_column(heatMapType)
+    result = market_store.top_over(table, rsi, bought=False)
+    if result is None:
+        result = (await db.execute(get_query('top_over_sold', table=table, rsi=rsi))).fetchall()
 
     return [
         schemas.HeatMap(
@@ -73,45 +48,19 @@ def get_tos(heatMapType: str, timeType: str, db: Session = Depends(get_db)):
 @router.get("/top-over-bought", 
             tags=group_tags,
             response_model=List[schemas.HeatMap])
-def get_tob(heatMapType: str, timeType: str, db: Session = Depends(get_db)):
+async def get_tob(heatMapType: str, timeType: str, db: AsyncSession = Depends(get_read_db)):
     """
     PARAM:
     - heatMapType: RSI Window example RSI7 | RSI14
     - timeType: FOUR_HOUR | ONE_HOUR | THIRTY_MINUTE | ONE_DAY
     """
-    if heatMapType not in ("RSI7", "RSI14"):
-        heatMapType = "RSI7"
-    if timeType == "FOUR_HOUR":
-        table_name = "f_coin_signal_4h"
-    elif timeType == "ONE_HOUR":
-        table_name = "f_coin_signal_1h"
-    elif timeType == "THIRTY_MINUTE":
-        table_name = "f_coin_signal_30m"
-    else:
-        table_name = "f_coin_signal_1d"
-    rsi_period = heatMapType.lower()
-
-    query = f"""
-        select symbol, {rsi_period} as rsi, close, low, high, update_time as date_created
-        from {SCHEMA}{table_name}
-        where {rsi_period} is not null
-        and {rsi_period} > 70
-        and symbol like '%VNST'
-        and open_time = (
-        select max(open_time) as open_time
-        from (
-            select open_time, count(symbol) as num
-            from {SCHEMA}{table_name}
-            where open_time >= now() - interval 7 day
-            group by open_time
-        ) d
-        where d.num > 0
-        )
-        order by {rsi_period} desc
-        limit 100;
-    """
+    heatMapType = heatMapType.strip().upper()
+    timeType = timeType.strip().upper()
 
-    result = db.execute(text(query)).fetchall()
+    table, rsi = signal_table(timeType), rsi_column(heatMapType)
+    result = market_store.top_over(table, rsi, bought=True)
+    if result is None:
+        result = (await db.execute(get_query('top_over_bought', table=table, rsi=rsi))).fetchall()
     return [
         schemas.HeatMap(
             symbol=row.symbol,
@@ -128,44 +77,21 @@ def get_tob(heatMapType: str, timeType: str, db: Session = Depends(get_db)):
 @router.get("/chart-data", 
             tags=group_tags,
             response_model=List[schemas.ChartData])
-def get_chart_data(heatMapType: str, timeType: str, db: Session = Depends(get_db)):
+async def get_chart_data(heatMapType: str, timeType: str, db: AsyncSession = Depends(get_read_db)):
     """
     PARAM:
     - heatMapType: RSI Window example RSI7 | RSI14
     - timeType: FOUR_HOUR | ONE_HOUR | THIRTY_MINUTE | ONE_DAY
     """
-    if heatMapType not in ("RSI7", "RSI14"):
-        heatMapType = "RSI7"
+    heatMapType = heatMapType.strip().upper()
     timeType = timeType.strip().upper()
-    if timeType == "FOUR_HOUR":
-        table_name = "f_coin_signal_4h"
-    elif timeType == "ONE_HOUR":
-        table_name = "f_coin_signal_1h"
-    elif timeType == "THIRTY_MINUTE":
-        table_name = "f_coin_signal_30m"
-    else:
-        table_name = "f_coin_signal_1d"
-    rsi_period = heatMapType.strip().lower()
 
-    time_limit = (datetime.now(timezone.utc) - timedelta(days=5)).strftime('%Y-%m-%d %H:%M:%S')
-    query = f"""
-        select symbol,
-            rsi,
-            percentage_change
-        from (
-        SELECT symbol, open_time,
-            {rsi_period} AS rsi,
-            ({rsi_period} - lead({rsi_period}) over (PARTITION by symbol order by open_time desc)) AS percentage_change,
-            row_number() over (PARTITION by symbol order by open_time desc) AS r
-        FROM {SCHEMA}{table_name}
-        WHERE symbol LIKE '%VNST'
-        	and {rsi_period} is not null
-            and open_time > "{time_limit}"
-        ) a
-        where r=1 and rsi is not null and percentage_change is not null
-        ORDER BY symbol asc
-    """
-    result = db.execute(text(query)).fetchall()
+    time_limit = (datetime.now(timezone.utc) - timedelta(days=5)).replace(tzinfo=None, microsecond=0)
+    table, rsi = signal_table(timeType), rsi_column(heatMapType)
+    result = market_store.chart_data(table, rsi)
+    if result is None:
+        query = get_query('chart_data', table=table, rsi=rsi)
+        result = (await db.execute(query, {'time_limit': time_limit.strftime('%Y-%m-%d %H:%M:%S')})).fetchall()
     return [
         schemas.ChartData(
             symbol=row.symbol,
@@ -179,28 +105,15 @@ def get_chart_data(heatMapType: str, timeType: str, db: Session = Depends(get_db
 @router.get("/original-pair-list", 
             tags=group_tags,
             response_model=List[schemas.OriSymbol])
-def get_original_pair_list(timeType: str, db: Session = Depends(get_db)) -> List[schemas.OriSymbol]:
+async def get_original_pair_list(timeType: str, db: AsyncSession = Depends(get_read_db)) -> List[schemas.OriSymbol]:
     """
     PARAM:
     - timeType: FOUR_HOUR | ONE_HOUR | THIRTY_MINUTE | ONE_DAY
     """
-    timeType = timeType.strip()
-    if timeType == "FOUR_HOUR":
-        table_name = "pattern_matching_4h"
-    elif timeType == "ONE_HOUR":
-        table_name = "pattern_matching_1h"
-    elif timeType == "THIRTY_MINUTE":
-        table_name = "pattern_matching_30m"
-    else:
-        table_name = "pattern_matching_1d"
-
-    query = f"""
-                SELECT  symbol2 as symbol, MAX(start_date2) AS discovered_symbol_time
-                FROM {SCHEMA}{table_name}
-                GROUP BY symbol2
-                order by symbol2
-            """
-    result = db.execute(text(query)).fetchall()
+    timeType = timeType.strip().upper()
+    table = pattern_table(timeType)
+    result = await read_snapshot(db, 'snap_original_pair_list', {'source': table}) \
+        or (await db.execute(get_query('original_pair_list', table=table))).fetchall()
     return [
         schemas.OriSymbol(
             symbol=row.symbol,
@@ -212,48 +125,24 @@ def get_original_pair_list(timeType: str, db: Session = Depends(get_db)) -> List
 @router.get("/fibonacci-info",
             tags=group_tags,
             response_model=schemas.RefSymbol)
-def get_fibo_info(originalPair, timeType, db: Session = Depends(get_db)) -> schemas.RefSymbol:
+async def get_fibo_info(originalPair, timeType, db: AsyncSession = Depends(get_read_db)) -> schemas.RefSymbol:
     """
     PARAM:
     - originalPair: example VBTCVNST, ...
     - timeType: FOUR_HOUR | ONE_HOUR | ONE_DAY
     """
-    originalPair = originalPair.strip()
-    timeType = timeType.strip()
-    if timeType == "FOUR_HOUR":
-        table_name = "pattern_matching_4h"
-    elif timeType == "ONE_HOUR":
-        table_name = "pattern_matching_1h"
-    else:
-        table_name = "pattern_matching_1d"
-
-    query = f"""
-        SELECT 
-            pm.symbol2 as original_symbol, 
-            pm.start_date2 as original_start_date, 
-            pm.end_date as original_end_date, 
-            pm.prices2 as original_prices, 
-            pm.s2_norm as original_fibonacci, 
-            pm.symbol1 as similar_symbol, 
-            pm.start_date1 as similar_start_date, 
-            pm.end_date as similar_end_date, 
-            pm.prices1 as similar_prices, 
-            pm.s1_norm as similar_fibonacci 
-        FROM {SCHEMA}{table_name} pm 
-        WHERE pm.symbol2 = '{originalPair}'
-        AND pm.start_date2 = ( 
-            SELECT MAX(start_date2) 
-            FROM {SCHEMA}{table_name} 
-            WHERE symbol2 = '{originalPair}'
-        )
-    """
+    originalPair = originalPair.strip().upper()
+    timeType = timeType.strip().upper()
+    # no 30m fibonacci, THIRTY_MINUTE read the 1d table
+    table_name = pattern_table(timeType) if timeType != "THIRTY_MINUTE" else PATTERN_TABLES['ONE_DAY']
+    query = get_query('fibonacci_info', table=table_name)
     result = []
     try:
-        result = db.execute(text(query)).fetchall()  #
-        if not result or len(result) == 0:
-            raise HTTPException(status_code=404, detail="No data found")
+        result = (await db.execute(query, {'symbol': originalPair})).fetchall()
     except Exception as e:
         print(e)
+    if not result or len(result) == 0:
+        raise HTTPException(status_code=404, detail="No data found")
     r = result[0]
     res = schemas.RefSymbol(
         originalSymbol=r[0],
@@ -1,44 +1,27 @@
+import numpy as np
 import app.schemas.prices as schemas
 from app.core.config import settings
 
 from app.core.router_decorated import APIRouter
 from fastapi import Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from app.db.session import get_db
+from app.db.session import get_read_db
+from app.db.queries import get_query
+from app.db.snapshots import read_snapshot
+from app.core.market_store import market_store
 
 router = APIRouter()
-SCHEMA = settings.SCHEMA_1 + "."
 group_tags=["Api-v1"]
 
 @router.get("/latest-prices",
             tags=group_tags,
             response_model=List[schemas.LatestPrice])
-def get_latest_prices(db: Session = Depends(get_db)):
+async def get_latest_prices(db: AsyncSession = Depends(get_read_db)):
     """ Get the latest prices of coins"""
-    query = f"""
-        select left(t1.symbol, char_length(t1.symbol) - 4) as coin, t1.close as price, 
-               round(((t1.close - t3.close) * 100 / t3.close), 2) as price_change
-        from {SCHEMA}f_coin_signal_5m t1
-        join (
-            select symbol, max(open_time) as latest_open_time
-            from {SCHEMA}f_coin_signal_5m
-            where open_time >= now() - interval 100 hour
-            group by symbol
-        ) t2 on t1.symbol = t2.symbol and t1.open_time = t2.latest_open_time
-        join (
-            select symbol, close, open_time
-            from {SCHEMA}f_coin_signal_1d
-            where (symbol, open_time) in (
-                select symbol, max(open_time)
-                from {SCHEMA}f_coin_signal_1d
-                where open_time >= now() - interval 20 day
-                group by symbol
-            )
-        ) t3 on t1.symbol = t3.symbol;
-    """
-    result = db.execute(text(query)).fetchall()
+    result = market_store.latest_prices() \
+        or await read_snapshot(db, 'snap_latest_prices') \
+        or (await db.execute(get_query('latest_prices'))).fetchall()
     
     if not result:
         raise HTTPException(status_code=404, detail="No data found")
@@ -53,64 +36,57 @@ def get_latest_prices(db: Session = Depends(get_db)):
     ]
 
 
+def nullable(values: np.ndarray) -> list:
+    """ float array -> list, nan -> None
+    """
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def columnar_prices(rows) -> schemas.CoinPricesColumnar:
+    """ (symbol, open_time, close) rows -> parallel lists per symbol and a symbol x time price matrix
+    """
+    if not rows:
+        return schemas.CoinPricesColumnar()
+    symbols, sym = np.unique(np.array([row.symbol for row in rows], dtype=object), return_inverse=True)
+    times, col = np.unique(np.array([row.open_time for row in rows], dtype='datetime64[s]'), return_inverse=True)
+    matrix = np.full((len(symbols), len(times)), np.nan)
+    matrix[sym, col] = np.array([row.close for row in rows], dtype=np.float64)
+    price = matrix[:, -1]
+    # the first time is the close one day before only if a symbol had a bar then
+    prev = matrix[:, 0] if times[-1] - times[0] == np.timedelta64(1, 'D') else np.full(len(symbols), np.nan)
+    # same symbols as the row layout: a bar at the last time or one day before
+    keep = ~np.isnan(price) | ~np.isnan(prev)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.round((price - prev) / prev * 100, 2)
+
+    matrix = matrix[keep]
+    used = ~np.isnan(matrix).all(axis=0)  # times with a bar of a kept symbol
+    return schemas.CoinPricesColumnar(
+        symbols=symbols[keep].tolist(),
+        prices=nullable(price[keep]),
+        price_changes=nullable(change[keep]),
+        timestamps=times[used].astype(np.int64).tolist(),
+        list_prices=nullable(matrix[:, used]),
+    )
+
+
 @router.get("/coin-prices", 
             tags=group_tags,
-            response_model=List[schemas.CoinPrice])
-def get_coin_prices(db: Session = Depends(get_db)):
+            response_model=List[schemas.CoinPrice] | schemas.CoinPricesColumnar)
+async def get_coin_prices(layout: str = 'rows', db: AsyncSession = Depends(get_read_db)):
     """ Get the price of coins
+    PARAM:
+    - layout: rows (default, one object per coin) | columnar (parallel lists, shared timestamps, price matrix)
     """
-    query = f"""
-        WITH MaxTime AS (
-            -- Step 1: Get the maximum open_time and its minute part
-            SELECT 
-                MAX(open_time) AS max_open_time,
-                EXTRACT(MINUTE FROM MAX(open_time)) AS max_minute
-            FROM 
-                {SCHEMA}coin_prices_5m
-        ),
-        FilteredTimes AS (
-            -- Step 2: Filter records to only those within the last 24 hours with the same minute as the max_open_time
-            SELECT 
-                symbol,
-                open_time,
-                close
-            FROM 
-                {SCHEMA}coin_prices_5m
-            WHERE 
-                open_time >= (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime)
-                AND EXTRACT(MINUTE FROM open_time) = (SELECT max_minute FROM MaxTime)
-        ),
-        MaxTimePrices AS (
-            -- Step 3: Get the close prices at max_open_time and max_open_time - INTERVAL 1 DAY
-            SELECT 
-                symbol,
-                MAX(CASE WHEN open_time = (SELECT max_open_time FROM MaxTime) THEN close END) AS close_at_max_time,
-                MAX(CASE WHEN open_time = (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime) THEN close END) AS close_at_prev_day
-            FROM 
-                {SCHEMA}coin_prices_5m
-            WHERE 
-                open_time IN ((SELECT max_open_time FROM MaxTime), (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime))
-            GROUP BY 
-                symbol
-        )
-        -- Step 4: Group by symbol and concatenate close prices, calculate price change
-        SELECT 
-            ft.symbol,
-            mp.close_at_max_time as price,
-            ROUND(((mp.close_at_max_time - mp.close_at_prev_day) / mp.close_at_prev_day) * 100, 2) AS percent_change,
-            GROUP_CONCAT(ft.close ORDER BY ft.open_time SEPARATOR ', ') AS list_prices
-        FROM 
-            FilteredTimes ft
-        JOIN 
-            MaxTimePrices mp ON ft.symbol = mp.symbol
-        GROUP BY 
-            ft.symbol, mp.close_at_max_time, mp.close_at_prev_day
-        ORDER BY 
-            ft.symbol;
-    """
+    if layout.strip().lower() == 'columnar':
+        try:
+            rows = (await db.execute(get_query('coin_prices_rows'))).fetchall()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail="Query data error")
+        return columnar_prices(rows)
 
     try:
-        result = db.execute(text(query)).fetchall()
+        result = await read_snapshot(db, 'snap_coin_prices') or (await db.execute(get_query('coin_prices'))).fetchall()
     except Exception as e:
         raise HTTPException(status_code=500, detail="Query data error")
 
@@ -122,4 +98,4 @@ def get_coin_prices(db: Session = Depends(get_db)):
             list_prices=[float(price) for price in row.list_prices.split(",")]
         )
         for row in result
-    ]
\ No newline at end of file
+    ]
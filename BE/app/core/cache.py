@@ -1,22 +1,33 @@
 
+import hashlib, json, math, random, time
 import regex as re
+from urllib.parse import urlencode
 from fastapi import APIRouter
-from redis import ConnectionPool, SSLConnection
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import get_flat_dependant
+from fastapi.routing import APIRoute
 from datetime import datetime, timedelta
-# import app.api.v1.endpoints as api_v1
+from functools import partial
+import app.api.v1.endpoints as api_v1
 import app.api.v2.endpoints as api_v2
 import app.api.v2_2.endpoints as api_v2_2
 
 
-def at_every_n_min(minutes: int) -> int:
-    time = datetime.now() + timedelta(minutes=minutes)
+def at_every_n_min(minutes: int, now: datetime | None = None) -> int:
+    """ timestamp of the next multiple of `minutes` in the hour, e.g. n=5 at 10:03 -> 10:05
+    """
+    time = (now or datetime.now()) + timedelta(minutes=minutes)
     ts = int(time.replace(minute=time.minute // minutes * minutes, second=0, microsecond=0).timestamp())
     return ts
 
-def at_every_hours_min(minutes: int) -> int:
-    time = datetime.now() + timedelta(hours=1)
-    ts = int(time.replace(minute=minutes, second=0, microsecond=0).timestamp())
-    return ts
+def at_every_hours_min(minutes: int, now: datetime | None = None) -> int:
+    """ timestamp of the next hh:`minutes`, e.g. m=5 at 10:03 -> 10:05, at 10:07 -> 11:05
+    """
+    now = now or datetime.now()
+    time = now.replace(minute=minutes, second=0, microsecond=0)
+    if time <= now:
+        time += timedelta(hours=1)
+    return int(time.timestamp())
 
 CACHE_PATHS = {
     'GET': {},
@@ -24,6 +35,10 @@ CACHE_PATHS = {
     'GET-MATCH': {},
     'POST-MATCH': {},
 }
+# route key (path or pattern in CACHE_PATHS) -> rules to build the cache key
+CACHE_KEYS = {}
+# type: no-exp | duration (expire `ttl` secs after write) | at-time (expire at the next `at()` timestamp,
+# computed on every write so aligned expiries stay correct for the life of the process)
 CACHE_TYPE = {
     'no-exp':
         {
@@ -53,112 +68,291 @@ CACHE_TYPE = {
     'at-eh-m5':
         {
             'type': 'at-time',
-            'ttl': at_every_hours_min(5),
+            'at': partial(at_every_hours_min, 5),
         },
     'at-eh-m10':
         {
             'type': 'at-time',
-            'ttl': at_every_hours_min(10),
+            'at': partial(at_every_hours_min, 10),
         },
     'at-e5m':
         {
             'type': 'at-time',
-            'ttl': at_every_n_min(5),
+            'at': partial(at_every_n_min, 5),
         },
     'at-e30m':
         {
             'type': 'at-time',
-            'ttl': at_every_n_min(30),
+            'at': partial(at_every_n_min, 30),
+        },
+    # stale-while-revalidate: after expiry the stale body is still served for `stale` secs
+    # while one request refresh it in background
+    'swr-1m':
+        {
+            'type': 'duration',
+            'ttl': 60,
+            'stale': 600,
+        },
+    'swr-5m':
+        {
+            'type': 'duration',
+            'ttl': 300,
+            'stale': 1800,
+        },
+    'swr-eh-m5':
+        {
+            'type': 'at-time',
+            'at': partial(at_every_hours_min, 5),
+            'stale': 3600,
+        },
+    'swr-eh-m10':
+        {
+            'type': 'at-time',
+            'at': partial(at_every_hours_min, 10),
+            'stale': 3600,
+        },
+    # probabilistic early refresh (XFetch): the closer to expiry and the slower the query,
+    # the more likely a request refresh the entry in background before it expire
+    # beta > 1 favors earlier refresh
+    'xf-1m':
+        {
+            'type': 'duration',
+            'ttl': 60,
+            'beta': 1.0,
+        },
+    'xf-5m':
+        {
+            'type': 'duration',
+            'ttl': 300,
+            'beta': 1.0,
+        },
+    # negative cache: 404 and empty results of a route, short ttl so new data show up fast
+    'neg-30s':
+        {
+            'type': 'duration',
+            'ttl': 30,
+        },
+    'neg-1m':
+        {
+            'type': 'duration',
+            'ttl': 60,
         },
 }
+# results cached by the negative policy of a route
+NEGATIVE_STATUS = (404,)
+NEGATIVE_BODIES = (b'', b'[]', b'{}', b'null', b'""')
+
+
+def is_negative_result(status_code: int, body: bytes) -> bool:
+    """ not found or empty result, e.g. an unknown symbol
+    """
+    return status_code in NEGATIVE_STATUS or (status_code == 200 and body.strip() in NEGATIVE_BODIES)
+
+
+def refresh_early(cache_type: str, fresh_until: float | None, delta: float, now: float) -> bool:
+    """ XFetch: refresh before expiry with probability growing as expiry gets closer
+    delta: secs the last computation took
+    """
+    beta = CACHE_TYPE[cache_type].get('beta')
+    if not beta or fresh_until is None or delta <= 0:
+        return False
+    return now - delta * beta * math.log(1 - random.random()) >= fresh_until
+
+def get_expire_at(cache_type: str, now: float | None = None) -> float | None:
+    """ unix timestamp when an entry of this cache type written now expire, None mean no expire
+    """
+    policy = CACHE_TYPE[cache_type]
+    now = time.time() if now is None else now
+    if policy['type'] == 'duration':
+        return now + policy['ttl']
+    elif policy['type'] == 'at-time':
+        return policy['at'](datetime.fromtimestamp(now))
+    return None
+
+# compiled route -> cache type index, built once after all routers are registered
+_CACHE_INDEX: dict[str, tuple[re.Pattern, dict[str, tuple[str, str]]] | None] = {}
+# (method, path) -> (route key, cache type) | None, also remember uncached paths
+_CACHE_MEMO: dict[tuple[str, str], tuple[str, str] | None] = {}
+_CACHE_MEMO_SIZE = 10000
+
+def build_cache_index() -> None:
+    """ compile every '<METHOD>-MATCH' pattern of a method into a single regex
+    each pattern become a named group, the matched group name give the route and its cache type
+    """
+    _CACHE_INDEX.clear()
+    _CACHE_MEMO.clear()
+    for method in ('GET', 'POST'):
+        patterns = CACHE_PATHS.get(method+'-MATCH', {})
+        if not patterns:
+            _CACHE_INDEX[method] = None
+            continue
+        groups, routes = [], {}
+        for i, (pattern, cache_type) in enumerate(patterns.items()):
+            name = f"r{i}"
+            groups.append(f"(?P<{name}>{pattern.lstrip('^').rstrip('$')})")
+            routes[name] = (pattern, cache_type)
+        _CACHE_INDEX[method] = (re.compile(r'^(?:' + '|'.join(groups) + r')$'), routes)
+
+def get_cache_route(method: str, path: str) -> tuple[str, str] | None:
+    """ check if path is in cache list, return (route key, cache type) if exist, else return None
+    route key is the registered path or pattern, it select the key rules in CACHE_KEYS
+    """
+    path = path.strip().rstrip('/')
+    cache_type = CACHE_PATHS.get(method, {}).get(path)
+    if cache_type is not None:
+        return path, cache_type
+    memo_key = (method, path)
+    if memo_key in _CACHE_MEMO:
+        return _CACHE_MEMO[memo_key]
+
+    if method not in _CACHE_INDEX:
+        build_cache_index()
+    index = _CACHE_INDEX.get(method)
+    route = None
+    if index is not None:
+        m = index[0].match(path)
+        route = index[1][m.lastgroup] if m else None
+    # path params make the number of paths unbounded, keep the memo small
+    if len(_CACHE_MEMO) >= _CACHE_MEMO_SIZE:
+        _CACHE_MEMO.clear()
+    _CACHE_MEMO[memo_key] = route
+    return route
 
 def get_cache_type(method: str, path: str) -> str | None:
     """ check if path is in cache list, return cache type if exist, else return None
     """
-    path = path.strip().rstrip('/')
-    try:
-        return CACHE_PATHS[method][path]
-    except Exception as e:
-        for key in CACHE_PATHS[method+'-MATCH']:
-            if re.match(key, path):
-                return CACHE_PATHS[method+'-MATCH'][key]
-        print(e)
-        return None
-    
+    route = get_cache_route(method, path)
+    return route[1] if route is not None else None
+
+# params longer than this are replaced by a fixed size digest in the key
+KEY_PARAM_MAX_LEN = 64
+
+def get_cache_key(method: str, path: str, route_key: str, query: list[tuple[str, str]], body: bytes = b'') -> str:
+    """ canonical cache key: "<method>:<path>:<params>"
+    - only query params the endpoint declare are kept, sorted by name then value
+    - values of the route's `upper` params are upper cased
+    - POST json body is re-serialized with sorted keys
+    - long params string is hashed to a fixed size digest
+    """
+    rules = CACHE_KEYS.get(route_key, {})
+    declared, upper = rules.get('params'), rules.get('upper', ())
+    items = []
+    for name, value in query:
+        if declared is not None and name not in declared:
+            continue  # unknown params (e.g. cache busters) do not change the response
+        value = value.strip()
+        items.append((name, value.upper() if name in upper else value))
+    param = urlencode(sorted(items))
+    if method.upper() != 'GET' and body:
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+        except ValueError:
+            pass  # not json, use the raw body
+        param += ':' + body.decode('utf-8', 'replace')
+    if len(param) > KEY_PARAM_MAX_LEN:
+        param = '#' + hashlib.blake2b(param.encode(), digest_size=16).hexdigest()
+    return f"{method.lower().strip()}:{path.strip().strip('/')}:{param}"
+
+def _reads_raw_request(dependant: Dependant) -> bool:
+    """ the endpoint or one of its dependencies take the Request, it may read any query param
+    """
+    if dependant.request_param_name or dependant.http_connection_param_name:
+        return True
+    return any(_reads_raw_request(sub) for sub in dependant.dependencies)
+
+def _add_cache_path(method: str, path: str, cache_type: str, route: APIRoute, upper_params: tuple, tables: tuple,
+                    negative_type: str | None = None) -> None:
+    if '{' in path and '}' in path:
+        path = r'^' + re.sub(r'\{\w+\}', r'[^\/]+', path.replace(r'/',r'\/')) + r'$'
+        CACHE_PATHS[method+'-MATCH'][path] = cache_type
+    else:
+        CACHE_PATHS[method][path] = cache_type
+    dependant = getattr(route, 'dependant', None)
+    # query params of the endpoint and of its dependencies, None (keep them all) if it read the raw request
+    flat = get_flat_dependant(dependant, skip_repeats=True) if dependant is not None else None
+    CACHE_KEYS[path] = {
+        'params': {p.alias for p in flat.query_params} if flat is not None and not _reads_raw_request(dependant) else None,
+        'required': {p.alias for p in flat.query_params if p.required} if flat is not None else set(),
+        'upper': set(upper_params),
+        'tables': tuple(tables),
+        'negative': negative_type,
+    }
+
+def get_cache_tables(route_key: str) -> tuple:
+    """ tables a cached route read from, its entries are dropped when one of them is updated
+    """
+    return CACHE_KEYS.get(route_key, {}).get('tables', ())
+
+def get_tagged_tables() -> set:
+    """ every table a cached route is tagged with, a table update outside this set invalidate nothing
+    """
+    return {table for rules in CACHE_KEYS.values() for table in rules.get('tables', ())}
+
+def get_negative_cache_type(route_key: str) -> str | None:
+    """ cache type of the 404 and empty results of a route, None mean they are not cached
+    """
+    return CACHE_KEYS.get(route_key, {}).get('negative')
+
 # add path
-def router_cache(router:APIRouter, prefix:str, cahce_type:str='in-1m', spec_method:str='ALL') -> None:
+def router_cache(router:APIRouter, prefix:str, cahce_type:str='in-1m', spec_method:str='ALL', upper_params: tuple = (),
+                 tables: tuple = (), negative_type: str | None = None) -> None:
+    """ cache every route of a router with a CACHE_TYPE policy, e.g. 'in-5m' | 'swr-5m' | 'xf-1m'
+    - spec_method: ALL | GET | POST, POST only for idempotent query endpoints
+    - upper_params: query params whose value is case insensitive, e.g. ('timeType',)
+    - tables: tables the routes read, entries are invalidated when a writer publish an update of one of them
+    - negative_type: policy of the 404 and empty results, e.g. 'neg-1m', None to not cache them
+    """
+    if cahce_type not in CACHE_TYPE:
+        raise ValueError(f"Unknown cache type: {cahce_type}")
+    if negative_type is not None and negative_type not in CACHE_TYPE:
+        raise ValueError(f"Unknown cache type: {negative_type}")
+    # index is rebuilt on the next lookup
+    _CACHE_INDEX.clear()
+    _CACHE_MEMO.clear()
     spec_method = spec_method.upper()
-    if spec_method == 'ALL':
-        for route in router.routes:
-            # skip path end with '/' to avoid duplicate cache
-            if route.path[-1:] == '/':
-                continue
-            path = prefix+route.path
-            if '{' in path and '}' in path:
-                path = r'^' + re.sub(r'\{\w+\}', r'[^\/]+', path.replace(r'/',r'\/')) + r'$'
-                for method in route.methods:
-                    CACHE_PATHS[method+'-MATCH'][path] = cahce_type
-            else:
-                for method in route.methods:
-                    CACHE_PATHS[method][path] = cahce_type
-    else:
-        for route in router.routes:
-            # skip path end with '/' to avoid duplicate cache
-            if route.path[-1:] == '/':
-                continue
-            path = prefix+route.path
-            if spec_method in route.methods and '{' in path and '}' in path:
-                path = r'^' + re.sub(r'\{\w+\}', '[^\/]+', path.replace('/','\/')) + r'$'
-                for method in route.methods:
-                    CACHE_PATHS[spec_method+'-MATCH'][path] = cahce_type
-            else:
-                if spec_method in route.methods:
-                    CACHE_PATHS[spec_method][path] = cahce_type
+    for route in router.routes:
+        # skip path end with '/' to avoid duplicate cache
+        if route.path[-1:] == '/':
+            continue
+        for method in route.methods:
+            if spec_method == 'ALL' or spec_method == method:
+                _add_cache_path(method, prefix+route.path, cahce_type, route, upper_params, tables, negative_type)
 
 # API-v1
-# all path in search.router cache end at 10 min every hour
-# router_cache(api_v1.search.router, "/api/v1/search", 'at-eh-m10', 'GET')
-# prefix = "/api/v1/search"
-# for route in api_v1.search.router.routes:
-#     for method in route.methods:
-#         if method == 'GET':
-#             CACHE_PATHS[method][prefix+route.path] = 'at-eh-m10'
-        # todo: add POST cache path -> add prossecing post body to hash key in middleware file
-
+# all path in prices.router cache in 1 min
+# coin_prices: table of the price crawler (data/data_crawler.py), it publish an update after each run
+router_cache(api_v1.prices.router, "/api/v1/prices", 'in-1m',
+             tables=('f_coin_signal_5m', 'f_coin_signal_1d', 'coin_prices_5m', 'coin_prices', 'snap_latest_price',
+                     'snap_price_sparkline'))
 # all path in ai_analysis.router cache end at 5 min every hour
-# router_cache(api_v1.ai_analysis.router, "/api/v1/ai-analysis", 'at-eh-m5')
-# prefix = "/api/v1/ai-analysis"
-# for route in api_v1.ai_analysis.router.routes:
-#     for method in route.methods:
-#         CACHE_PATHS[method][prefix+route.path] = 'at-eh-m5'
-
-# all path in al_trade.router cache in 5 min
-# router_cache(api_v1.al_trade.router, "/api/v1/al-trade", 'in-5m')
-# prefix = "/api/v1/al-trade"
-# for route in api_v1.al_trade.router.routes:
-#     for method in route.methods:
-#         CACHE_PATHS[method][prefix+route.path] = 'in-5m'
-    # todo: cache and get cache in function, cache time depend on query params
-
-# all path in search.router cache end at 5 min every hour
-# router_cache(api_v1.prices.router, "/api/v1/prices", 'in-1m')
-# prefix = "/api/v1/prices"
-# for route in api_v1.prices.router.routes:
-#     for method in route.methods:
-#         CACHE_PATHS[method][prefix+route.path] = 'in-1m'
+# unknown symbols (404) cached 1 min
+router_cache(api_v1.ai_analysis.router, "/api/v1/ai-analysis", 'at-eh-m5',
+             tables=('coin_predictions', 'f_coin_signal_1h', 'snap_predict_rollup'), negative_type='neg-1m')
+# all path in al_trade.router cache in 5 min, serve stale while refreshing
+router_cache(api_v1.al_trade.router, "/api/v1/al-trade", 'swr-5m',
+             upper_params=('heatMapType', 'timeType', 'originalPair'),
+             tables=('f_coin_signal_30m', 'f_coin_signal_1h', 'f_coin_signal_4h', 'f_coin_signal_1d',
+                     'pattern_matching_30m', 'pattern_matching_1h', 'pattern_matching_4h', 'pattern_matching_1d',
+                     'snap_pattern_latest'),
+             negative_type='neg-1m')
+# all GET path in search.router cache end at 10 min every hour
+router_cache(api_v1.search.router, "/api/v1/search", 'at-eh-m10', 'GET',
+             tables=('app_quote', 'tmp_currency'), negative_type='neg-1m')
 
 # API-v2
 router_cache(api_v2.prices.router, "/api/v2/prices", 'in-1m')
 router_cache(api_v2.ai_analysis.router, "/api/v2/ai-analysis", 'at-eh-m5')
-router_cache(api_v2.al_trade.router, "/api/v2/al-trade", 'in-5m')
+router_cache(api_v2.al_trade.router, "/api/v2/al-trade", 'swr-5m')
 router_cache(api_v2.search.router, "/api/v2/search", 'at-eh-m10')
 
 # API-v2.1
 router_cache(api_v2_2.prices.router, "/api/v2_1/prices", 'in-1m')
 router_cache(api_v2_2.ai_analysis.router, "/api/v2_1/ai-analysis", 'at-eh-m5')
-router_cache(api_v2_2.al_trade.router, "/api/v2_1/al-trade", 'in-5m')
+router_cache(api_v2_2.al_trade.router, "/api/v2_1/al-trade", 'swr-5m')
 router_cache(api_v2_2.sub_info.router, "/api/v2_1/sub-info", 'in-1h')
 router_cache(api_v2_2.chat.router, "/api/v2_1/ai-chat", 'in-1h')
              
 
 # print(CACHE_PATHS)
+
+build_cache_index()
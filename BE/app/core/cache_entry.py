@@ -0,0 +1,79 @@
+import gzip, hashlib, json
+from dataclasses import dataclass
+
+try:  # optional, better ratio than gzip for json
+    import brotli
+except ImportError:
+    brotli = None
+
+# stored value = MAGIC + json header + "\n" + response body
+MAGIC = b'CE1'
+# smaller bodies are stored as is, compression would not pay off
+COMPRESS_MIN_BYTES = 1024
+
+
+def compress(body: bytes, encoding: str | None = 'gzip') -> tuple[bytes, str | None]:
+    """ compress a body once at write time, return (data, content-encoding)
+    encoding: gzip | br | None, br fall back to gzip when brotli is not installed
+    """
+    if not encoding or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(body, quality=5), 'br'
+    return gzip.compress(body, compresslevel=6), 'gzip'
+
+
+def make_etag(body: bytes) -> str:
+    """ weak validator from the plain body, the same for every content-encoding of it
+    """
+    return 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def decompress(data: bytes, encoding: str | None) -> bytes:
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'br':
+        return brotli.decompress(data)
+    return data
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    fresh_until: float | None = None    # unix timestamp, after that the entry is stale, None mean always fresh
+    stale_until: float | None = None    # unix timestamp, after that the entry must not be served
+    delta: float = 0                    # secs spent to compute the body, used by early refresh
+    encoding: str | None = None         # content-encoding of body: gzip | br | None
+    etag: str | None = None             # digest of the plain body, sent as ETag
+    tags: tuple = ()                    # tables the body is read from, for invalidation
+    status: int = 200                   # status code of the response, 404 for negative entries
+    negative: bool = False              # 404 or empty result, cached by the negative policy of the route
+
+    def dumps(self) -> bytes:
+        header = {'f': self.fresh_until, 's': self.stale_until, 'd': round(self.delta, 4), 'e': self.encoding,
+                  't': self.etag, 'g': list(self.tags), 'c': self.status, 'n': self.negative}
+        return MAGIC + json.dumps(header, separators=(',', ':')).encode() + b'\n' + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'CacheEntry | None':
+        if not data.startswith(MAGIC):
+            # value written before entries had a header, no expire info -> treat as miss
+            return None
+        end = data.index(b'\n')
+        header = json.loads(data[len(MAGIC):end])
+        return cls(body=data[end + 1:], fresh_until=header['f'], stale_until=header['s'], delta=header['d'],
+                   encoding=header.get('e'), etag=header.get('t'), tags=tuple(header.get('g') or ()),
+                   status=header.get('c', 200), negative=header.get('n', False))
+
+    def plain_body(self) -> bytes:
+        return decompress(self.body, self.encoding)
+
+    def is_fresh(self, now: float) -> bool:
+        return self.fresh_until is None or now < self.fresh_until
+
+    def is_servable(self, now: float) -> bool:
+        """ fresh, or stale but still inside the stale-while-revalidate window
+        """
+        if self.is_fresh(now):
+            return True
+        return self.stale_until is not None and now < self.stale_until
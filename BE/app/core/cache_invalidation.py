@@ -0,0 +1,89 @@
+import asyncio
+from typing import Callable
+from redis.asyncio import Redis
+from app.core.local_cache import local_cache
+from app.core.redis_client import breaker, get_pubsub_redis
+
+# writers publish the name of an updated table on this channel, e.g. PUBLISH cache:invalidate coin_predictions
+CACHE_INVALIDATE_CHANNEL = 'cache:invalidate'
+# redis set of the cache keys built from a table
+TAG_PREFIX = 'cache:tag:'
+# secs a tag set live after its last write, longer than any cache ttl
+TAG_TTL = 86400
+
+
+def tag_key(table: str) -> str:
+    return TAG_PREFIX + table
+
+
+async def invalidate_tables(redis: Redis, tables: list[str]) -> int:
+    """ drop every cache entry tagged with one of the tables, in L1 and in redis
+    return number of redis keys dropped
+    """
+    dropped = 0
+    for table in tables:
+        local_cache.delete_tag(table)
+        keys = await breaker.call(lambda: redis.smembers(tag_key(table)))
+        pipe = redis.pipeline(transaction=False)
+        if keys:
+            pipe.unlink(*keys)
+        pipe.unlink(tag_key(table))
+        result = await breaker.call(pipe.execute)
+        dropped += result[0] if keys else 0
+    return dropped
+
+
+class InvalidationListener:
+    """ subscribe to the invalidation channel and drop the entries of every updated table
+    every worker run one, so each worker clear its own L1; the redis unlink is idempotent
+    the subscription has its own connection, `redis` (the shared pool) is used for the unlinks
+    """
+    def __init__(self, redis: Redis, tables: set | None = None):
+        self.redis = redis
+        self.pubsub_redis = get_pubsub_redis()
+        # tables the cached routes are tagged with, an update of another table is reported (publisher misconfigured)
+        self.tables = tables
+        self.task: asyncio.Task | None = None
+        # other subscribers of the table updates, called with the table name, e.g. snapshot maintenance
+        self.callbacks: list[Callable[[str], None]] = []
+
+    def add_callback(self, callback: Callable[[str], None]) -> None:
+        self.callbacks.append(callback)
+
+    async def run(self) -> None:
+        while True:
+            if not breaker.allow():
+                # redis is down, the breaker probe tell when it is back
+                await asyncio.sleep(1)
+                continue
+            try:
+                pubsub = self.pubsub_redis.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(CACHE_INVALIDATE_CHANNEL)
+                try:
+                    async for message in pubsub.listen():
+                        table = message['data'].decode() if isinstance(message['data'], bytes) else str(message['data'])
+                        if self.tables is not None and table not in self.tables:
+                            print("Cache invalidation of a table no cached route is tagged with", table)
+                        dropped = await invalidate_tables(self.redis, [table])
+                        print("Cache invalidated", table, dropped)
+                        for callback in self.callbacks:
+                            callback(table)
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # redis down, retry later
+                print("Cache invalidation listener error", e)
+                await asyncio.sleep(5)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.pubsub_redis.aclose(close_connection_pool=True)
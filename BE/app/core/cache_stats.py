@@ -0,0 +1,99 @@
+import os, time
+from redis.asyncio import Redis
+
+# redis sorted set per cached route: member = cache key, score = expire timestamp
+ROUTE_KEYS_PREFIX = 'cache:route:'
+
+
+def route_keys_key(route_key: str) -> str:
+    return ROUTE_KEYS_PREFIX + route_key
+
+
+class RouteStats:
+    """ counters of one cached route in this worker
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.sets = 0
+        self.set_failures = 0
+        self.lookup_seconds = 0.0
+        self.lookup_max_seconds = 0.0
+        self.payload_bytes = 0
+        self.payload_max_bytes = 0
+        self.stored_bytes = 0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0,
+            'sets': self.sets,
+            'set_failures': self.set_failures,
+            'avg_lookup_ms': round(self.lookup_seconds / lookups * 1000, 3) if lookups else 0,
+            'max_lookup_ms': round(self.lookup_max_seconds * 1000, 3),
+            'avg_payload_bytes': self.payload_bytes // self.sets if self.sets else 0,
+            'max_payload_bytes': self.payload_max_bytes,
+            'avg_stored_bytes': self.stored_bytes // self.sets if self.sets else 0,
+        }
+
+
+class CacheStats:
+    """ per route cache counters of this worker, keyed by route key (path or pattern in CACHE_PATHS)
+    """
+    def __init__(self):
+        self.routes: dict[str, RouteStats] = {}
+        self.started = time.time()
+
+    def route(self, route_key: str) -> RouteStats:
+        stats = self.routes.get(route_key)
+        if stats is None:
+            stats = self.routes[route_key] = RouteStats()
+        return stats
+
+    def record_lookup(self, route_key: str, seconds: float, result: str) -> None:
+        """ result: hit | stale | miss
+        """
+        stats = self.route(route_key)
+        if result == 'hit':
+            stats.hits += 1
+        elif result == 'stale':
+            stats.stale_hits += 1
+        else:
+            stats.misses += 1
+        stats.lookup_seconds += seconds
+        stats.lookup_max_seconds = max(stats.lookup_max_seconds, seconds)
+
+    def record_set(self, route_key: str, payload_bytes: int, stored_bytes: int, ok: bool) -> None:
+        stats = self.route(route_key)
+        if not ok:
+            stats.set_failures += 1
+            return
+        stats.sets += 1
+        stats.payload_bytes += payload_bytes
+        stats.payload_max_bytes = max(stats.payload_max_bytes, payload_bytes)
+        stats.stored_bytes += stored_bytes
+
+    async def live_keys(self, redis: Redis, route_keys: list[str]) -> dict[str, int]:
+        """ number of unexpired redis keys of each route, shared by every worker
+        """
+        now = time.time()
+        pipe = redis.pipeline(transaction=False)
+        for route_key in route_keys:
+            pipe.zremrangebyscore(route_keys_key(route_key), '-inf', now)
+            pipe.zcard(route_keys_key(route_key))
+        result = await pipe.execute()
+        return {route_key: result[i * 2 + 1] for i, route_key in enumerate(route_keys)}
+
+    def to_dict(self) -> dict:
+        return {
+            'pid': os.getpid(),
+            'uptime': int(time.time() - self.started),
+            'routes': {route_key: stats.to_dict() for route_key, stats in self.routes.items()},
+        }
+
+
+cache_stats = CacheStats()
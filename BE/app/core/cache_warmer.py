@@ -0,0 +1,133 @@
+import asyncio, itertools, time
+from urllib.parse import urlencode
+from starlette.types import ASGIApp
+from app.core.cache import CACHE_PATHS, CACHE_KEYS, CACHE_TYPE, get_expire_at
+
+HEATMAP_TYPES = ['RSI7', 'RSI14']
+TIME_TYPES = ['FOUR_HOUR', 'ONE_HOUR', 'THIRTY_MINUTE', 'ONE_DAY']
+
+# common param combinations of routes with required params, every combination is warmed
+# routes without required params are warmed with their defaults
+WARM_PARAMS = {
+    '/api/v1/al-trade/top-over-sold': {'heatMapType': HEATMAP_TYPES, 'timeType': TIME_TYPES},
+    '/api/v1/al-trade/top-over-bought': {'heatMapType': HEATMAP_TYPES, 'timeType': TIME_TYPES},
+    '/api/v1/al-trade/chart-data': {'heatMapType': HEATMAP_TYPES, 'timeType': TIME_TYPES},
+    '/api/v1/al-trade/original-pair-list': {'timeType': TIME_TYPES},
+}
+# secs before expiry a duration entry is refreshed, capped to 10% of its ttl
+WARM_LEAD = 30
+# secs after an at-time boundary, let the writers land the new rows first
+WARM_DELAY = 1
+# max warm requests running at the same time in a worker
+WARM_CONCURRENCY = 4
+
+
+class CacheWarmer:
+    """ recompute registered GET routes right before (duration) or at (at-time) their expiry
+    so real traffic never sees a cold cache. every worker run one, a key is recomputed only when
+    its stored entry is about to expire, the cache lease make sure by one worker only
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.task: asyncio.Task | None = None
+        self.semaphore = asyncio.Semaphore(WARM_CONCURRENCY)
+
+    def targets(self) -> list[tuple[str, str, str]]:
+        """ list of (path, query string, cache type) to keep warm
+        """
+        targets = []
+        for path, cache_type in CACHE_PATHS['GET'].items():
+            grid = WARM_PARAMS.get(path)
+            if grid is None:
+                if CACHE_KEYS.get(path, {}).get('required'):
+                    continue  # unknown values for required params
+                grid = {}
+            names = list(grid)
+            for values in itertools.product(*(grid[name] for name in names)):
+                targets.append((path, urlencode(list(zip(names, values))), cache_type))
+        return targets
+
+    def lead(self, cache_type: str) -> float:
+        """ secs before expiry an entry of a cache type is refreshed
+        """
+        policy = CACHE_TYPE[cache_type]
+        if policy['type'] == 'duration':
+            return min(WARM_LEAD, policy['ttl'] * 0.1)
+        return 0
+
+    def next_run(self, cache_type: str, now: float) -> float | None:
+        """ unix timestamp of the next refresh of a cache type, None mean never (no expire)
+        """
+        policy = CACHE_TYPE[cache_type]
+        if policy['type'] == 'duration':
+            return now + policy['ttl'] - self.lead(cache_type)
+        elif policy['type'] == 'at-time':
+            return get_expire_at(cache_type, now) + WARM_DELAY
+        return None
+
+    async def warm(self, path: str, query_string: str, cache_type: str) -> int:
+        """ send an internal request through the app, the cache middleware recompute and store it
+        unless the stored entry is still fresh for more than the lead (refreshed by another worker)
+        """
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': query_string.encode(),
+            'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 0),
+            'server': ('127.0.0.1', 80),
+            'cache.refresh': True,
+            'cache.refresh_lead': self.lead(cache_type),
+        }
+        status = {'code': 500}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+
+        async with self.semaphore:
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                print("Failed to warm cache", path, query_string, e)
+        return status['code']
+
+    async def run(self) -> None:
+        now = time.time()
+        # first pass at startup fill the cold cache
+        schedule = [(now, target) for target in self.targets()]
+        while True:
+            schedule.sort(key=lambda item: item[0])
+            if not schedule:
+                return
+            delay = schedule[0][0] - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.time()
+            due = [target for at, target in schedule if at <= now]
+            schedule = [item for item in schedule if item[0] > now]
+            await asyncio.gather(*(self.warm(path, query, cache_type) for path, query, cache_type in due))
+            for target in due:
+                at = self.next_run(target[2], time.time())
+                if at is not None:
+                    schedule.append((at, target))
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
@@ -26,6 +26,15 @@ class Settings(BaseSettings):
     MYSQL_SERVER: str | None = os.getenv("MYSQL_SERVER")
     MYSQL_PORT: int | None = os.getenv("MYSQL_PORT")
     MYSQL_DB: str | None = os.getenv("MYSQL_DB")
+    # read replicas of the same database, "host:port,host:port", empty -> every read go to MYSQL_SERVER
+    MYSQL_REPLICA_SERVERS: str = os.getenv("MYSQL_REPLICA_SERVERS", "")
+
+    # connection pool of each engine (primary and every replica), per worker
+    DB_POOL_SIZE: int = os.getenv("DB_POOL_SIZE") or 10
+    DB_MAX_OVERFLOW: int = os.getenv("DB_MAX_OVERFLOW") or 20
+    DB_POOL_TIMEOUT: float = os.getenv("DB_POOL_TIMEOUT") or 5      # secs to wait for a free connection
+    DB_POOL_RECYCLE: int = os.getenv("DB_POOL_RECYCLE") or 1800     # secs, below mysql wait_timeout
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING") or True
 
     SCHEMA_1: str | None = os.getenv("SCHEMA_1")
     SCHEMA_2: str | None = os.getenv("SCHEMA_2")
@@ -37,6 +46,10 @@ class Settings(BaseSettings):
     SQLALCHEMY_DATABASE_URL: str = (
         f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_SERVER}:{MYSQL_PORT}/{MYSQL_DB}"
     )
+    # same database through the asyncio driver, used by the read api
+    SQLALCHEMY_ASYNC_DATABASE_URL: str = (
+        f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_SERVER}:{MYSQL_PORT}/{MYSQL_DB}"
+    )
     print(SQLALCHEMY_DATABASE_URL)
 
     # Login configuration
@@ -56,7 +69,31 @@ class Settings(BaseSettings):
     REDIS_DB: int | None = os.getenv("REDIS_DB")
     REDIS_MAX_CONNECTIONS: int | None = os.getenv("REDIS_MAX_CONNECTIONS")
     REDIS_SSL: bool | None = os.getenv("REDIS_SSL")
-    
+    REDIS_SOCKET_TIMEOUT: float = os.getenv("REDIS_SOCKET_TIMEOUT") or 0.5
+    # failures in a row before redis is skipped, then secs before the first probe (doubled up to the max)
+    REDIS_BREAKER_FAILURES: int = os.getenv("REDIS_BREAKER_FAILURES") or 5
+    REDIS_BREAKER_BACKOFF: float = os.getenv("REDIS_BREAKER_BACKOFF") or 1
+    REDIS_BREAKER_MAX_BACKOFF: float = os.getenv("REDIS_BREAKER_MAX_BACKOFF") or 30
+
+    # In-process (L1) cache settings, per worker
+    CACHE_L1_MAX_BYTES: int = os.getenv("CACHE_L1_MAX_BYTES") or 64 * 1024 * 1024
+    # secs a worker may hold the recompute lease of a cache key
+    CACHE_LEASE_TTL: float = os.getenv("CACHE_LEASE_TTL") or 10
+    # secs other workers wait for the lease holder before computing by themselves
+    CACHE_LEASE_WAIT: float = os.getenv("CACHE_LEASE_WAIT") or 2
+    # encoding of cached bodies: gzip | br (need brotli installed) | empty to store plain
+    CACHE_COMPRESSION: str = os.getenv("CACHE_COMPRESSION", "gzip")
+    # recompute cached routes before / at their expiry
+    CACHE_WARMER: bool = os.getenv("CACHE_WARMER") or True
+
+    # "latest per symbol" snapshot tables, refreshed when their source tables are updated
+    SNAPSHOTS: bool = os.getenv("SNAPSHOTS") or True
+    SNAPSHOT_INTERVAL: float = os.getenv("SNAPSHOT_INTERVAL") or 60   # secs between two checks of the source tables
+
+    # latest bars of the signal tables kept in each worker, al-trade / prices endpoints answered from memory
+    MARKET_STORE: bool = os.getenv("MARKET_STORE") or True
+    MARKET_STORE_INTERVAL: float = os.getenv("MARKET_STORE_INTERVAL") or 10   # secs between two polls of new bars
+
     # Chat GPT settings
     GPT_KEY: str | None = os.getenv("GPT_KEY")
      
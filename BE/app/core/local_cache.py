@@ -0,0 +1,104 @@
+import time
+from typing import Any
+from collections import OrderedDict
+from app.core.config import settings
+
+# rough per-entry bookkeeping cost (tuple, dict slot, key object) added to the payload size
+ENTRY_OVERHEAD = 100
+
+
+class LocalCache:
+    """ in-process L1 cache in front of redis, one per worker
+    - bounded by total bytes, least recently used entries are evicted first
+    - every entry keeps the same expire time as its redis copy
+    - expired entries are not returned by get() but kept for get_stale() until evicted
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_item_bytes: int | None = None):
+        self.max_bytes = max_bytes
+        # a single huge response must not flush the whole cache
+        self.max_item_bytes = max_item_bytes or max_bytes // 8
+        # key -> (value, expire_at, size, tags)
+        self.data: OrderedDict[str, tuple[Any, float | None, int, tuple]] = OrderedDict()
+        # tag -> keys, to drop every entry built from an updated table
+        self.tags: dict[str, set[str]] = {}
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any | None:
+        item = self.data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, expire_at, _, _ = item
+        if expire_at is not None and expire_at <= time.time():
+            # keep the expired entry as a stale fallback until it is replaced or evicted
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: str) -> Any | None:
+        """ get value even if it expired, use when a fresh value is not available in time
+        """
+        item = self.data.get(key)
+        return None if item is None else item[0]
+
+    def set(self, key: str, value: Any, expire_at: float | None = None, size: int | None = None, tags: tuple = ()) -> bool:
+        """ expire_at: unix timestamp, None mean no expire
+        size: payload bytes of value, default len(value)
+        tags: names to invalidate the entry with, see delete_tag()
+        """
+        size = len(key) + (len(value) if size is None else size) + ENTRY_OVERHEAD
+        if size > self.max_item_bytes or (expire_at is not None and expire_at <= time.time()):
+            return False
+        self.delete(key)
+        self.data[key] = (value, expire_at, size, tags)
+        self.used_bytes += size
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        while self.used_bytes > self.max_bytes and self.data:
+            self.delete(next(iter(self.data)))
+            self.evictions += 1
+        return True
+
+    def delete(self, key: str) -> None:
+        item = self.data.pop(key, None)
+        if item is not None:
+            self.used_bytes -= item[2]
+            for tag in item[3]:
+                keys = self.tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tags[tag]
+
+    def delete_tag(self, tag: str) -> int:
+        """ drop every entry set with this tag, return number of entries dropped
+        """
+        keys = self.tags.pop(tag, set())
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self.data.clear()
+        self.tags.clear()
+        self.used_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0,
+            'evictions': self.evictions,
+            'entries': len(self.data),
+            'used_bytes': self.used_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+local_cache = LocalCache(max_bytes=settings.CACHE_L1_MAX_BYTES)
@@ -0,0 +1,291 @@
+import asyncio, time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from app.core.config import settings
+from app.db.queries import get_query
+from app.db.session import read_session
+
+# signal tables kept in memory -> hours of bars kept, the widest window an endpoint look at
+STORE_TABLES = {
+    'f_coin_signal_5m': 100,        # latest-prices: last 5m close of the last 100 hours
+    'f_coin_signal_30m': 7 * 24,    # top-over-*: last bar of the last 7 days
+    'f_coin_signal_1h': 7 * 24,
+    'f_coin_signal_4h': 7 * 24,
+    'f_coin_signal_1d': 20 * 24,    # latest-prices: last 1d close of the last 20 days
+}
+# columns the store-served endpoints read; atr14 (f_coin_signal_1h) is only read by the prediction
+# accuracy queries, which stay on sql and the rollup snapshot, so it is not loaded
+FLOAT_COLUMNS = ('close', 'high', 'low', 'rsi7', 'rsi14')
+# top-over-* thresholds and size, same as the sql
+OVER_SOLD = 30
+OVER_BOUGHT = 70
+TOP_LIMIT = 100
+# heatmap tables: their rsi extremes are computed once per bar for every rsi window
+HEATMAP_TABLES = ('f_coin_signal_30m', 'f_coin_signal_1h', 'f_coin_signal_4h', 'f_coin_signal_1d')
+HEATMAP_RSI = ('rsi7', 'rsi14')
+# chart-data: rsi change over the bars of the last days, same as the sql
+CHART_DAYS = 5
+
+# rows returned to the endpoints, same fields as the sql rows
+HeatMapRow = namedtuple('HeatMapRow', ['symbol', 'rsi', 'close', 'low', 'high', 'date_created'])
+ChartRow = namedtuple('ChartRow', ['symbol', 'rsi', 'percentage_change'])
+LatestPriceRow = namedtuple('LatestPriceRow', ['coin', 'price', 'price_change'])
+# what top-over-sold, top-over-bought and chart-data return for one table and rsi window
+RsiExtremes = namedtuple('RsiExtremes', ['over_sold', 'over_bought', 'chart'])
+
+
+def to_float(value: float) -> float | None:
+    return None if np.isnan(value) else float(value)
+
+
+def to_datetime(value: np.datetime64) -> datetime | None:
+    return None if np.isnat(value) else value.astype('datetime64[s]').item()
+
+
+class Frame:
+    """ rolling window of one table: one numpy array per column, rows ordered by open_time
+    symbols are stored as int32 codes of the store
+    """
+    def __init__(self, hours: int):
+        self.window = np.timedelta64(hours, 'h')
+        self.sym = np.empty(0, dtype=np.int32)
+        self.open_time = np.empty(0, dtype='datetime64[s]')
+        self.update_time = np.empty(0, dtype='datetime64[s]')
+        self.columns = {name: np.empty(0, dtype=np.float64) for name in FLOAT_COLUMNS}
+        self.refreshed_at = 0.0     # last successful poll
+
+    def __len__(self) -> int:
+        return len(self.open_time)
+
+    @property
+    def last_open_time(self) -> datetime | None:
+        return to_datetime(self.open_time[-1]) if len(self) else None
+
+    def tail(self, since: np.datetime64) -> slice:
+        """ rows with open_time >= since
+        """
+        return slice(int(np.searchsorted(self.open_time, since, 'left')), len(self))
+
+    def merge(self, sym: np.ndarray, open_time: np.ndarray, update_time: np.ndarray, columns: dict) -> bool:
+        """ replace the rows from the first new open_time with the new rows and drop the rows out of the window
+        return False if the new rows are the ones already stored
+        """
+        if not len(open_time):
+            return False
+        keep = slice(0, self.tail(open_time[0]).start)
+        old = slice(keep.stop, len(self))
+        if (old.stop - old.start == len(open_time)
+                and np.array_equal(self.sym[old], sym)
+                and np.array_equal(self.open_time[old], open_time)
+                and np.array_equal(self.update_time[old], update_time)):
+            return False  # the open bar has not been rewritten since the last poll
+        self.sym = np.concatenate([self.sym[keep], sym])
+        self.open_time = np.concatenate([self.open_time[keep], open_time])
+        self.update_time = np.concatenate([self.update_time[keep], update_time])
+        for name in FLOAT_COLUMNS:
+            self.columns[name] = np.concatenate([self.columns[name][keep], columns[name]])
+        start = self.tail(self.open_time[-1] - self.window).start
+        if start:
+            self.sym = self.sym[start:]
+            self.open_time = self.open_time[start:]
+            self.update_time = self.update_time[start:]
+            for name in FLOAT_COLUMNS:
+                self.columns[name] = self.columns[name][start:]
+        return True
+
+    def latest_per_symbol(self) -> np.ndarray:
+        """ index of the newest row of every symbol
+        """
+        # rows are in open_time order: the last occurrence of a symbol is its newest row
+        reverse = self.sym[::-1]
+        _, first = np.unique(reverse, return_index=True)
+        return len(self) - 1 - first
+
+
+class MarketStore:
+    """ latest bars of the signal tables in the memory of each worker, polled every MARKET_STORE_INTERVAL secs
+    (and on table update notifications) for the rows with open_time >= the last one seen.
+    the al-trade and prices endpoints are answered with numpy filters and sorts, they fall back to sql
+    while a table is not loaded or its poll failing.
+    the heatmap lists are computed once when a table change, the requests only look them up
+    """
+    def __init__(self):
+        self.frames = {table: Frame(hours) for table, hours in STORE_TABLES.items()}
+        self.symbols: list[str] = []
+        self.symbol_codes: dict[str, int] = {}
+        self.vnst = np.empty(0, dtype=bool)     # per symbol code: quoted in VNST
+        self.extremes: dict[tuple[str, str], RsiExtremes] = {}   # (table, rsi column) -> heatmap lists
+        self.locks = {table: asyncio.Lock() for table in STORE_TABLES}
+        self.task: asyncio.Task | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    def encode(self, symbols: list[str]) -> np.ndarray:
+        for symbol in symbols:
+            if symbol not in self.symbol_codes:
+                self.symbol_codes[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        if len(self.vnst) < len(self.symbols):
+            self.vnst = np.array([s.endswith('VNST') for s in self.symbols], dtype=bool)
+        return np.fromiter((self.symbol_codes[s] for s in symbols), dtype=np.int32, count=len(symbols))
+
+    def frame(self, table: str) -> Frame | None:
+        """ frame of a table if it is loaded and fresh, None -> use sql
+        """
+        frame = self.frames.get(table)
+        if frame is None or not len(frame):
+            return None
+        if time.time() - frame.refreshed_at > max(settings.MARKET_STORE_INTERVAL * 5, 60):
+            return None
+        return frame
+
+    async def refresh(self, table: str) -> bool:
+        """ load the new rows of a table, return True if the frame changed
+        """
+        frame = self.frames[table]
+        async with self.locks[table]:
+            db = await read_session()
+            try:
+                rows = (await db.execute(get_query('market_store_rows', table=table),
+                                         {'since': frame.last_open_time, 'hours': STORE_TABLES[table]})).fetchall()
+            finally:
+                await db.close()
+            changed = frame.merge(
+                self.encode([row.symbol for row in rows]),
+                np.array([row.open_time for row in rows], dtype='datetime64[s]'),
+                np.array([row.update_time for row in rows], dtype='datetime64[s]'),
+                {name: np.array([getattr(row, name) for row in rows], dtype=np.float64) for name in FLOAT_COLUMNS},
+            )
+            if changed and table in HEATMAP_TABLES:
+                self.update_extremes(table)
+            frame.refreshed_at = time.time()
+        return changed
+
+    async def refresh_all(self) -> None:
+        for table in STORE_TABLES:
+            try:
+                await self.refresh(table)
+            except Exception as e:
+                print("Failed to refresh market store", table, e)
+
+    def on_table_updated(self, table: str) -> None:
+        """ invalidation listener callback: a writer updated `table`
+        """
+        if table in STORE_TABLES:
+            task = asyncio.create_task(self.refresh(table))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self) -> None:
+        while True:
+            await self.refresh_all()
+            await asyncio.sleep(settings.MARKET_STORE_INTERVAL)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        for task in [self.task, *self.tasks]:
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+    def scan_top_over(self, frame: Frame, rsi: str, bought: bool) -> list[HeatMapRow]:
+        """ VNST symbols of the last bar with rsi < 30 (sold, lowest first) or > 70 (bought, highest first)
+        """
+        rows = frame.tail(frame.open_time[-1])
+        values = frame.columns[rsi][rows]
+        with np.errstate(invalid='ignore'):
+            mask = self.vnst[frame.sym[rows]] & (values > OVER_BOUGHT if bought else values < OVER_SOLD)
+        index = np.nonzero(mask)[0]
+        index = index[np.argsort(-values[index] if bought else values[index], kind='stable')][:TOP_LIMIT] + rows.start
+        return [
+            HeatMapRow(
+                symbol=self.symbols[frame.sym[i]],
+                rsi=float(frame.columns[rsi][i]),
+                close=to_float(frame.columns['close'][i]),
+                low=to_float(frame.columns['low'][i]),
+                high=to_float(frame.columns['high'][i]),
+                date_created=to_datetime(frame.update_time[i]),
+            )
+            for i in index
+        ]
+
+    def scan_chart_data(self, frame: Frame, rsi: str, time_limit: datetime) -> list[ChartRow]:
+        """ last rsi of every VNST symbol since time_limit and its change from the bar before
+        """
+        values = frame.columns[rsi]
+        mask = self.vnst[frame.sym] & ~np.isnan(values) & (frame.open_time > np.datetime64(time_limit, 's'))
+        index = np.nonzero(mask)[0]
+        # rows are in open_time order, a stable sort by symbol keep it inside each symbol
+        index = index[np.argsort(frame.sym[index], kind='stable')]
+        sym = frame.sym[index]
+        last = np.nonzero(np.append(sym[1:] != sym[:-1], True))[0] if len(sym) else index
+        last = last[(last > 0) & (sym[last - 1] == sym[last])]  # symbols with a previous bar
+        rows = [
+            ChartRow(
+                symbol=self.symbols[sym[i]],
+                rsi=float(values[index[i]]),
+                percentage_change=float(values[index[i]] - values[index[i - 1]]),
+            )
+            for i in last
+        ]
+        rows.sort(key=lambda row: row.symbol)
+        return rows
+
+    def update_extremes(self, table: str) -> None:
+        """ recompute the heatmap lists of a table for every rsi window, after a new or rewritten bar
+        """
+        frame = self.frames[table]
+        time_limit = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=CHART_DAYS)
+        for rsi in HEATMAP_RSI:
+            self.extremes[(table, rsi)] = RsiExtremes(
+                over_sold=self.scan_top_over(frame, rsi, bought=False),
+                over_bought=self.scan_top_over(frame, rsi, bought=True),
+                chart=self.scan_chart_data(frame, rsi, time_limit),
+            )
+
+    def top_over(self, table: str, rsi: str, bought: bool) -> list[HeatMapRow] | None:
+        """ top-over-bought / top-over-sold of a table, None -> use sql
+        """
+        extremes = self.extremes.get((table, rsi)) if self.frame(table) is not None else None
+        if extremes is None:
+            return None
+        return extremes.over_bought if bought else extremes.over_sold
+
+    def chart_data(self, table: str, rsi: str) -> list[ChartRow] | None:
+        """ chart-data of a table, None -> use sql
+        """
+        extremes = self.extremes.get((table, rsi)) if self.frame(table) is not None else None
+        if extremes is None:
+            return None
+        return extremes.chart
+
+    def latest_prices(self) -> list[LatestPriceRow] | None:
+        """ last 5m close of every symbol and its change from the last 1d close
+        """
+        prices, daily = self.frame('f_coin_signal_5m'), self.frame('f_coin_signal_1d')
+        if prices is None or daily is None:
+            return None
+        ref = np.full(len(self.symbols), np.nan)
+        last = daily.latest_per_symbol()
+        ref[daily.sym[last]] = daily.columns['close'][last]
+        last = prices.latest_per_symbol()
+        sym = prices.sym[last]
+        close = prices.columns['close'][last]
+        ref = ref[sym]
+        has_ref = ~np.isnan(ref)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = np.round((close - ref) * 100 / ref, 2)
+        rows = [
+            LatestPriceRow(coin=self.symbols[s][:-4], price=to_float(c), price_change=to_float(p))
+            for s, c, p in zip(sym[has_ref], close[has_ref], change[has_ref])
+        ]
+        rows.sort(key=lambda row: row.coin)
+        return rows
+
+
+market_store = MarketStore()
@@ -0,0 +1,138 @@
+import asyncio, time
+from typing import Awaitable, Callable, TypeVar
+from redis.asyncio import Redis, BlockingConnectionPool, Connection, SSLConnection
+from app.core.config import settings
+
+T = TypeVar('T')
+
+# one pool per worker process, shared by every request
+# BlockingConnectionPool makes a request wait (up to `timeout`) for a free connection
+# instead of failing with "Too many connections" when the pool is busy
+pool = BlockingConnectionPool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    password=settings.REDIS_PASSWORD,
+    db=settings.REDIS_DB or 0,
+    socket_connect_timeout=0.05,                    # secs time to check connection
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,   # secs time to wait for a reply
+    retry_on_timeout=False,
+    max_connections=settings.REDIS_MAX_CONNECTIONS or 50,
+    timeout=settings.REDIS_SOCKET_TIMEOUT,          # secs time to wait for a free connection
+    connection_class=SSLConnection if settings.REDIS_SSL else Connection  # SSLConnection for secure connection
+)
+
+
+def get_redis() -> Redis:
+    """ get a client bound to the shared pool, the client itself is cheap to create
+    """
+    return Redis(connection_pool=pool)
+
+
+def get_pubsub_redis() -> Redis:
+    """ get a client with its own connection for a long-lived subscription
+    a subscribed connection stay checked out of its pool, on the shared pool it would be taken from the requests
+    """
+    return Redis(connection_pool=BlockingConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        password=settings.REDIS_PASSWORD,
+        db=settings.REDIS_DB or 0,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_timeout=None,                        # a subscriber wait for messages as long as it takes
+        max_connections=1,
+        timeout=settings.REDIS_SOCKET_TIMEOUT,
+        connection_class=SSLConnection if settings.REDIS_SSL else Connection
+    ))
+
+
+async def close_redis() -> None:
+    await pool.disconnect()
+
+
+class RedisUnavailable(Exception):
+    """ redis is skipped while the circuit breaker is open
+    """
+
+
+class CircuitBreaker:
+    """ health of redis as seen by this worker
+    closed: calls go to redis, `failures` errors or timeouts in a row open the breaker
+    open: calls fail at once with RedisUnavailable, the cache fall through to the db without waiting
+    half-open: a background ping probe redis after the back-off window, success close the breaker,
+    failure open it again for twice the window (up to max_backoff)
+    """
+    def __init__(self, failures: int = 5, backoff: float = 1, max_backoff: float = 30):
+        self.max_failures = failures
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probe: asyncio.Task | None = None
+
+    def allow(self) -> bool:
+        return self.state == 'closed'
+
+    def success(self) -> None:
+        self.failures = 0
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == 'closed' and self.failures >= self.max_failures:
+            self.open()
+
+    def open(self) -> None:
+        print("Redis circuit breaker open for", self.backoff, "secs")
+        self.state = 'open'
+        self.opened_at = time.time()
+        if self.probe is None or self.probe.done():
+            self.probe = asyncio.get_running_loop().create_task(self.run_probe())
+
+    def close(self) -> None:
+        print("Redis circuit breaker closed")
+        self.state = 'closed'
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self.opened_at = None
+
+    async def run_probe(self) -> None:
+        while self.state != 'closed':
+            await asyncio.sleep(self.backoff)
+            self.state = 'half-open'
+            try:
+                await asyncio.wait_for(get_redis().ping(), timeout=settings.REDIS_SOCKET_TIMEOUT)
+            except Exception:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                self.state = 'open'
+                self.opened_at = time.time()
+                continue
+            self.close()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], timeout: float | None = None) -> T:
+        """ run one redis call with a bounded wait, e.g. await breaker.call(lambda: redis.get(key))
+        """
+        if not self.allow():
+            raise RedisUnavailable(f"redis circuit breaker {self.state}")
+        try:
+            result = await asyncio.wait_for(fn(), timeout=timeout or settings.REDIS_SOCKET_TIMEOUT)
+        except Exception:
+            self.failure()
+            raise
+        self.success()
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'backoff': self.backoff,
+            'opened_at': self.opened_at,
+        }
+
+
+breaker = CircuitBreaker(
+    failures=settings.REDIS_BREAKER_FAILURES,
+    backoff=settings.REDIS_BREAKER_BACKOFF,
+    max_backoff=settings.REDIS_BREAKER_MAX_BACKOFF,
+)
@@ -0,0 +1,17 @@
+import secrets
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from app.core.config import settings
+
+security = HTTPBasic()
+def doc_auth(credentials: HTTPBasicCredentials = Depends(security)):
+    """ basic auth with DOC_PASSWORD, guard the docs and the admin endpoints
+    """
+    correct_password = secrets.compare_digest(credentials.password, settings.DOC_PASSWORD)
+    if not (correct_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect password",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return credentials.username
@@ -0,0 +1,79 @@
+import asyncio, uuid
+from typing import Any, Awaitable, Callable
+from redis.asyncio import Redis
+
+# compare and delete, only the owner of a lease can release it
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """ coalesce concurrent calls with the same key inside one worker
+    the first caller run the function, the others await its result
+    """
+    def __init__(self):
+        self.calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while (future := self.calls.get(key)) is not None:
+            try:
+                # shield: a cancelled follower must not cancel the leader's result
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this follower was cancelled
+                # the leader was cancelled (e.g. its client disconnected), not the followers:
+                # the first of them run fn, the others await it
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark as retrieved, followers (if any) still get the exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.calls[key]
+
+    def is_running(self, key: str) -> bool:
+        return key in self.calls
+
+    def in_flight(self) -> int:
+        return len(self.calls)
+
+
+class RedisLease:
+    """ short lived lock in redis, shared by every worker and replica
+    the holder recompute a cache key, the others wait for its result
+    """
+    def __init__(self, redis: Redis, ttl: float = 10, prefix: str = 'lease:'):
+        self.redis = redis
+        self.ttl_ms = int(ttl * 1000)
+        self.prefix = prefix
+        self.release_script = redis.register_script(RELEASE_LEASE_SCRIPT)
+
+    async def acquire(self, key: str) -> str | None:
+        """ return a token if the lease is taken, None if another worker hold it
+        """
+        token = uuid.uuid4().hex
+        if await self.redis.set(self.prefix + key, token, nx=True, px=self.ttl_ms):
+            return token
+        return None
+
+    async def release(self, key: str, token: str) -> None:
+        await self.release_script(keys=[self.prefix + key], args=[token])
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,122 @@
+""" query plan check: EXPLAIN every registered query (app/db/queries.py) on the database and fail on full table scans
+
+    python -m app.db.explain                    every query, every table / rsi variant
+    python -m app.db.explain top_over_sold ...  only these queries
+"""
+import argparse, sys
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+from sqlalchemy.engine import Engine
+from app.db.queries import QUERIES, EXPANDING, SIGNAL_TABLES, PATTERN_TABLES, RSI_COLUMNS, get_query
+from app.db.session import engine
+
+# a scan of a table estimated below this many rows is cheap enough
+MAX_SCAN_ROWS = 1000
+# query -> why a full scan is expected
+ALLOWED_SCANS = {
+    'search_currency': "symbol rlike :key, no index can serve a regex",
+    'snap_latest_prices': "snapshot, one row per symbol, read whole",
+    'snap_coin_prices': "snapshot, one row per symbol, read whole",
+    'snap_sparkline_prune': "snapshot, one row per symbol",
+}
+# variants of the queries with a {table} placeholder and no {rsi}, default: the pattern tables
+TABLE_VARIANTS = {
+    'market_store_rows': [*SIGNAL_TABLES.values(), 'f_coin_signal_5m'],
+}
+# {table}, {column} of snap_source_max, the sources the snapshot maintenance read
+SOURCE_COLUMNS = [
+    ('f_coin_signal_5m', 'open_time'),
+    ('f_coin_signal_1h', 'open_time'),
+    ('f_coin_signal_1d', 'open_time'),
+    ('coin_prices_5m', 'open_time'),
+    ('coin_predictions', 'open_time'),
+    *((table, 'start_date2') for table in PATTERN_TABLES.values()),
+]
+
+
+def sample_params() -> dict:
+    """ a realistic value of every bind param used in the registry
+    """
+    now = datetime.now()
+    return {
+        'time': (now - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S'),
+        'time_limit': (now - timedelta(days=5)).strftime('%Y-%m-%d %H:%M:%S'),
+        'since': now - timedelta(hours=2),
+        'open_time': now - timedelta(hours=1),
+        'hours': 24,
+        'symbol': 'BTCVNST',
+        'symbols': ['BTCVNST', 'ETHVNST'],
+        'n_predict': 1000,
+        'key': 'BTC',
+        'limit': 100,
+        'offset': 0,
+        'bot_id': '1',
+        'start_time': int((now - timedelta(days=30)).timestamp()),
+        'cursor_time': None,
+        'cursor_id': None,
+        'source': PATTERN_TABLES['ONE_HOUR'],
+        'name': 'latest_close',
+        'names': ['latest_close', 'ref_close'],
+        'watermark': str(now),
+    }
+
+
+def variants(name: str) -> list[dict]:
+    template = QUERIES[name]
+    if '{column}' in template:
+        return [{'table': table, 'column': column} for table, column in SOURCE_COLUMNS]
+    if '{rsi}' in template:
+        return [{'table': table, 'rsi': rsi} for table in SIGNAL_TABLES.values() for rsi in RSI_COLUMNS.values()]
+    if '{table}' in template:
+        return [{'table': table} for table in TABLE_VARIANTS.get(name, PATTERN_TABLES.values())]
+    return [{}]
+
+
+def explain(db: Engine, name: str, variant: dict, max_rows: int) -> list[str]:
+    """ full scans in the plan of one query variant, as messages
+    """
+    statement = text('EXPLAIN ' + get_query(name, **variant).text)
+    if name in EXPANDING:
+        statement = statement.bindparams(*(bindparam(param, expanding=True) for param in EXPANDING[name]))
+    params = sample_params()
+    with db.connect() as conn:
+        plan = conn.execute(statement, {key: params[key] for key in statement.compile().params}).fetchall()
+    problems = []
+    for row in plan:
+        step = row._mapping
+        table = step['table'] or ''
+        if step['type'] == 'ALL' and not table.startswith('<') and (step['rows'] or 0) >= max_rows:
+            # <derivedN> / <subqueryN> / <union...> are the materialized results of the query itself
+            problems.append(f"full scan of {table} (~{step['rows']} rows)")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="EXPLAIN the registered queries, fail on full table scans")
+    parser.add_argument('queries', nargs='*', help="query names, default all")
+    parser.add_argument('--max-rows', type=int, default=MAX_SCAN_ROWS, help="scans of smaller tables are allowed")
+    args = parser.parse_args()
+    names = args.queries or list(QUERIES)
+    failed = 0
+    for name in names:
+        for variant in variants(name):
+            label = name + ''.join(f" {key}={value}" for key, value in variant.items())
+            try:
+                problems = explain(engine, name, variant, args.max_rows)
+            except Exception as e:
+                print("ERROR", label, e)
+                failed += 1
+                continue
+            if problems and name in ALLOWED_SCANS:
+                print("ok   ", label, "(allowed:", ALLOWED_SCANS[name] + ")")
+            elif problems:
+                print("SCAN ", label, "; ".join(problems))
+                failed += 1
+            else:
+                print("ok   ", label)
+    print(f"{failed} failing query plan(s)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+""" versioned schema migrations: app/db/migrations/NNNN_name.sql, applied once each, in order
+
+    python -m app.db.migrate            apply the pending migrations
+    python -m app.db.migrate --list     show applied / pending migrations
+"""
+import argparse, os, re, sys
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from app.db.queries import SCHEMA
+from app.db.session import engine
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+# mysql has no "if not exists" for columns and indexes: these errors mean the statement was already
+# applied (by hand or by an interrupted run), the migration go on
+ALREADY_APPLIED = {
+    1050: 'table already exists',
+    1060: 'duplicate column name',
+    1061: 'duplicate key name',
+}
+MIGRATIONS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS {schema}schema_migrations (
+        version varchar(4) NOT NULL,
+        name varchar(255) NOT NULL,
+        applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (version)
+    )
+"""
+
+
+def list_migrations() -> list[tuple[str, str]]:
+    """ (version, file name) of every migration file, in version order
+    """
+    result = []
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE.match(name)
+        if match:
+            result.append((match.group(1), name))
+    return result
+
+
+def split_statements(sql: str) -> list[str]:
+    """ statements of a migration file, one per `;` at the end of a line, comment lines dropped
+    """
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in re.split(r';\s*$', '\n'.join(lines), flags=re.M) if statement.strip()]
+
+
+def applied_versions(db: Engine) -> set[str]:
+    with db.begin() as conn:
+        conn.execute(text(MIGRATIONS_TABLE_DDL.format(schema=SCHEMA)))
+        return {row.version for row in conn.execute(text(f"select version from {SCHEMA}schema_migrations"))}
+
+
+def apply_migration(db: Engine, version: str, name: str) -> None:
+    with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+        statements = split_statements(f.read().format(schema=SCHEMA))
+    # mysql commit every DDL statement by itself, a failed migration is re-run from its start
+    with db.begin() as conn:
+        for statement in statements:
+            try:
+                conn.execute(text(statement))
+            except DBAPIError as e:
+                code = e.orig.args[0] if e.orig is not None and e.orig.args else None
+                if code not in ALREADY_APPLIED:
+                    raise
+                print(f"  skip ({ALREADY_APPLIED[code]}):", statement.splitlines()[0])
+        conn.execute(text(f"insert into {SCHEMA}schema_migrations (version, name) values (:version, :name)"),
+                     {'version': version, 'name': name})
+
+
+def migrate(db: Engine = engine) -> list[str]:
+    """ apply the pending migrations, return their file names
+    """
+    applied = applied_versions(db)
+    done = []
+    for version, name in list_migrations():
+        if version in applied:
+            continue
+        print("Applying", name)
+        apply_migration(db, version, name)
+        done.append(name)
+    return done
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="apply the schema migrations of app/db/migrations")
+    parser.add_argument('--list', action='store_true', help="show applied / pending migrations and exit")
+    args = parser.parse_args()
+    if args.list:
+        applied = applied_versions(engine)
+        for version, name in list_migrations():
+            print('applied' if version in applied else 'pending', name)
+        return 0
+    done = migrate()
+    print(f"{len(done)} migration(s) applied")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
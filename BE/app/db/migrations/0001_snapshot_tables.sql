@@ -0,0 +1,55 @@
+-- snapshot tables kept by app/db/snapshots.py: small "latest per symbol" tables read by the endpoints
+-- with point lookups instead of aggregations, and the watermarks of their incremental refresh
+
+CREATE TABLE IF NOT EXISTS {schema}snap_latest_price (
+    symbol varchar(20) NOT NULL,
+    close double NULL,
+    open_time datetime NULL,
+    ref_close double NULL,          -- close of the last 1d bar
+    ref_open_time datetime NULL,
+    updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol)
+);
+
+CREATE TABLE IF NOT EXISTS {schema}snap_price_sparkline (
+    symbol varchar(20) NOT NULL,
+    price double NULL,
+    percent_change double NULL,
+    list_prices text NULL,          -- hourly closes of the last 24h, "p1, p2, ..."
+    open_time datetime NULL,
+    updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol)
+);
+
+CREATE TABLE IF NOT EXISTS {schema}snap_pattern_latest (
+    source varchar(32) NOT NULL,    -- pattern_matching_* table
+    symbol varchar(20) NOT NULL,
+    discovered_time datetime NULL,
+    updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, symbol)
+);
+
+CREATE TABLE IF NOT EXISTS {schema}snap_predict_rollup (
+    symbol varchar(20) NOT NULL,
+    open_time datetime NOT NULL,    -- hour of the real candle a prediction is checked against
+    n_pred int NOT NULL DEFAULT 0,
+    n_err int NOT NULL DEFAULT 0,
+    sum_err double NULL,
+    n_err_on_atr int NOT NULL DEFAULT 0,
+    sum_err_on_atr double NULL,
+    true_pred int NOT NULL DEFAULT 0,
+    n_profit int NOT NULL DEFAULT 0,
+    sum_profit_rate double NULL,
+    min_profit_rate double NULL,
+    max_profit_rate double NULL,
+    updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (symbol, open_time),
+    KEY idx_open_time (open_time)
+);
+
+CREATE TABLE IF NOT EXISTS {schema}snap_watermark (
+    name varchar(64) NOT NULL,
+    watermark varchar(32) NULL,     -- last source value folded into the snapshot
+    updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (name)
+);
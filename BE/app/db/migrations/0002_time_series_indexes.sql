@@ -0,0 +1,24 @@
+-- composite indexes of the time series tables
+-- (symbol, open_time): history of one symbol (predict-validate, fibonacci, market store per symbol)
+-- (open_time, symbol): every symbol of the latest bars (latest prices, heatmaps, sparklines, snapshots)
+
+CREATE INDEX idx_symbol_open_time ON {schema}f_coin_signal_5m (symbol, open_time);
+CREATE INDEX idx_open_time_symbol ON {schema}f_coin_signal_5m (open_time, symbol);
+
+CREATE INDEX idx_symbol_open_time ON {schema}f_coin_signal_30m (symbol, open_time);
+CREATE INDEX idx_open_time_symbol ON {schema}f_coin_signal_30m (open_time, symbol);
+
+CREATE INDEX idx_symbol_open_time ON {schema}f_coin_signal_1h (symbol, open_time);
+CREATE INDEX idx_open_time_symbol ON {schema}f_coin_signal_1h (open_time, symbol);
+
+CREATE INDEX idx_symbol_open_time ON {schema}f_coin_signal_4h (symbol, open_time);
+CREATE INDEX idx_open_time_symbol ON {schema}f_coin_signal_4h (open_time, symbol);
+
+CREATE INDEX idx_symbol_open_time ON {schema}f_coin_signal_1d (symbol, open_time);
+CREATE INDEX idx_open_time_symbol ON {schema}f_coin_signal_1d (open_time, symbol);
+
+CREATE INDEX idx_symbol_open_time ON {schema}coin_prices_5m (symbol, open_time);
+CREATE INDEX idx_open_time_symbol ON {schema}coin_prices_5m (open_time, symbol);
+
+CREATE INDEX idx_symbol_open_time ON {schema}coin_predictions (symbol, open_time);
+CREATE INDEX idx_open_time_symbol ON {schema}coin_predictions (open_time, symbol);
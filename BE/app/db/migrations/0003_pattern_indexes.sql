@@ -0,0 +1,9 @@
+-- pattern tables: original pair list (latest start_date2 of every symbol2) and fibonacci info of one symbol2
+
+CREATE INDEX idx_symbol2_start_date2 ON {schema}pattern_matching_30m (symbol2, start_date2);
+
+CREATE INDEX idx_symbol2_start_date2 ON {schema}pattern_matching_1h (symbol2, start_date2);
+
+CREATE INDEX idx_symbol2_start_date2 ON {schema}pattern_matching_4h (symbol2, start_date2);
+
+CREATE INDEX idx_symbol2_start_date2 ON {schema}pattern_matching_1d (symbol2, start_date2);
@@ -0,0 +1,18 @@
+-- quote asset of the signal tables as an indexed generated column, the heatmaps filter on
+-- quote_asset = 'VNST' instead of the leading wildcard symbol like '%VNST' (a full scan)
+-- every quote asset traded has 4 letters (VNST, USDT)
+
+ALTER TABLE {schema}f_coin_signal_5m ADD COLUMN quote_asset varchar(8) GENERATED ALWAYS AS (right(symbol, 4)) VIRTUAL;
+CREATE INDEX idx_quote_asset_open_time ON {schema}f_coin_signal_5m (quote_asset, open_time);
+
+ALTER TABLE {schema}f_coin_signal_30m ADD COLUMN quote_asset varchar(8) GENERATED ALWAYS AS (right(symbol, 4)) VIRTUAL;
+CREATE INDEX idx_quote_asset_open_time ON {schema}f_coin_signal_30m (quote_asset, open_time);
+
+ALTER TABLE {schema}f_coin_signal_1h ADD COLUMN quote_asset varchar(8) GENERATED ALWAYS AS (right(symbol, 4)) VIRTUAL;
+CREATE INDEX idx_quote_asset_open_time ON {schema}f_coin_signal_1h (quote_asset, open_time);
+
+ALTER TABLE {schema}f_coin_signal_4h ADD COLUMN quote_asset varchar(8) GENERATED ALWAYS AS (right(symbol, 4)) VIRTUAL;
+CREATE INDEX idx_quote_asset_open_time ON {schema}f_coin_signal_4h (quote_asset, open_time);
+
+ALTER TABLE {schema}f_coin_signal_1d ADD COLUMN quote_asset varchar(8) GENERATED ALWAYS AS (right(symbol, 4)) VIRTUAL;
+CREATE INDEX idx_quote_asset_open_time ON {schema}f_coin_signal_1d (quote_asset, open_time);
@@ -0,0 +1,5 @@
+-- trade bot history: keyset pages on (exit_time, id) of the closed trades of a bot, open positions by entry_time
+-- the trades table live in its own schema
+
+CREATE INDEX idx_bot_status_exit_time ON trade_bot.trades (bot_id, status, exit_time, id);
+CREATE INDEX idx_bot_status_entry_time ON trade_bot.trades (bot_id, status, entry_time, id);
@@ -0,0 +1,680 @@
+from sqlalchemy import text, bindparam
+from sqlalchemy.sql.elements import TextClause
+from app.core.config import settings
+
+SCHEMA = settings.SCHEMA_1 + "."
+
+# identifiers can not be bound, a template is formatted only with these (one statement per variant)
+SIGNAL_TABLES = {
+    'FOUR_HOUR': 'f_coin_signal_4h',
+    'ONE_HOUR': 'f_coin_signal_1h',
+    'THIRTY_MINUTE': 'f_coin_signal_30m',
+    'ONE_DAY': 'f_coin_signal_1d',
+}
+PATTERN_TABLES = {
+    'FOUR_HOUR': 'pattern_matching_4h',
+    'ONE_HOUR': 'pattern_matching_1h',
+    'THIRTY_MINUTE': 'pattern_matching_30m',
+    'ONE_DAY': 'pattern_matching_1d',
+}
+RSI_COLUMNS = {
+    'RSI7': 'rsi7',
+    'RSI14': 'rsi14',
+}
+# source tables and time columns read by the snapshot maintenance
+SNAPSHOT_SOURCES = {'f_coin_signal_5m', 'coin_prices_5m', 'coin_predictions', 'open_time', 'start_date2'}
+IDENTIFIERS = {*SIGNAL_TABLES.values(), *PATTERN_TABLES.values(), *RSI_COLUMNS.values(), *SNAPSHOT_SOURCES}
+
+
+def signal_table(time_type: str) -> str:
+    """ FOUR_HOUR | ONE_HOUR | THIRTY_MINUTE | ONE_DAY -> f_coin_signal_* table, default 1d
+    """
+    return SIGNAL_TABLES.get(time_type, SIGNAL_TABLES['ONE_DAY'])
+
+
+def pattern_table(time_type: str) -> str:
+    """ FOUR_HOUR | ONE_HOUR | THIRTY_MINUTE | ONE_DAY -> pattern_matching_* table, default 1d
+    """
+    return PATTERN_TABLES.get(time_type, PATTERN_TABLES['ONE_DAY'])
+
+
+def rsi_column(heatmap_type: str) -> str:
+    """ RSI7 | RSI14 -> rsi column, default rsi7
+    """
+    return RSI_COLUMNS.get(heatmap_type, RSI_COLUMNS['RSI7'])
+
+
+# name -> sql template
+# {schema}, {table} and {rsi} are filled once per variant, request values are bind params (:name)
+QUERIES = {
+    # prices
+    'latest_prices': """
+        select left(t1.symbol, char_length(t1.symbol) - 4) as coin, t1.close as price,
+               round(((t1.close - t3.close) * 100 / t3.close), 2) as price_change
+        from {schema}f_coin_signal_5m t1
+        join (
+            select symbol, max(open_time) as latest_open_time
+            from {schema}f_coin_signal_5m
+            where open_time >= now() - interval 100 hour
+            group by symbol
+        ) t2 on t1.symbol = t2.symbol and t1.open_time = t2.latest_open_time
+        join (
+            select symbol, close, open_time
+            from {schema}f_coin_signal_1d
+            where (symbol, open_time) in (
+                select symbol, max(open_time)
+                from {schema}f_coin_signal_1d
+                where open_time >= now() - interval 20 day
+                group by symbol
+            )
+        ) t3 on t1.symbol = t3.symbol;
+    """,
+    'coin_prices': """
+        WITH MaxTime AS (
+            -- Step 1: Get the maximum open_time and its minute part
+            SELECT
+                MAX(open_time) AS max_open_time,
+                EXTRACT(MINUTE FROM MAX(open_time)) AS max_minute
+            FROM
+                {schema}coin_prices_5m
+        ),
+        FilteredTimes AS (
+            -- Step 2: Filter records to only those within the last 24 hours with the same minute as the max_open_time
+            SELECT
+                symbol,
+                open_time,
+                close
+            FROM
+                {schema}coin_prices_5m
+            WHERE
+                open_time >= (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime)
+                AND EXTRACT(MINUTE FROM open_time) = (SELECT max_minute FROM MaxTime)
+        ),
+        MaxTimePrices AS (
+            -- Step 3: Get the close prices at max_open_time and max_open_time - INTERVAL 1 DAY
+            SELECT
+                symbol,
+                MAX(CASE WHEN open_time = (SELECT max_open_time FROM MaxTime) THEN close END) AS close_at_max_time,
+                MAX(CASE WHEN open_time = (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime) THEN close END) AS close_at_prev_day
+            FROM
+                {schema}coin_prices_5m
+            WHERE
+                open_time IN ((SELECT max_open_time FROM MaxTime), (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime))
+            GROUP BY
+                symbol
+        )
+        -- Step 4: Group by symbol and concatenate close prices, calculate price change
+        SELECT
+            ft.symbol,
+            mp.close_at_max_time as price,
+            ROUND(((mp.close_at_max_time - mp.close_at_prev_day) / mp.close_at_prev_day) * 100, 2) AS percent_change,
+            GROUP_CONCAT(ft.close ORDER BY ft.open_time SEPARATOR ', ') AS list_prices
+        FROM
+            FilteredTimes ft
+        JOIN
+            MaxTimePrices mp ON ft.symbol = mp.symbol
+        GROUP BY
+            ft.symbol, mp.close_at_max_time, mp.close_at_prev_day
+        ORDER BY
+            ft.symbol;
+    """,
+    # rows of the coin_prices sparklines, aggregated in python (columnar layout)
+    'coin_prices_rows': """
+        WITH MaxTime AS (
+            SELECT
+                MAX(open_time) AS max_open_time,
+                EXTRACT(MINUTE FROM MAX(open_time)) AS max_minute
+            FROM
+                {schema}coin_prices_5m
+        )
+        SELECT symbol, open_time, close
+        FROM {schema}coin_prices_5m
+        WHERE
+            open_time >= (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime)
+            AND EXTRACT(MINUTE FROM open_time) = (SELECT max_minute FROM MaxTime)
+    """,
+    # al-trade
+    'top_over_sold': """
+        select symbol, {rsi} as rsi, close, low, high, update_time as date_created
+        from {schema}{table}
+        where {rsi} is not null
+        and {rsi} < 30
+        and quote_asset = 'VNST'  -- generated column, see migrations/0004
+        and open_time = (
+            select max(open_time)
+            from {schema}{table}
+            where open_time >= now() - interval 7 day
+        )
+        order by {rsi} asc
+        limit 100;
+    """,
+    'top_over_bought': """
+        select symbol, {rsi} as rsi, close, low, high, update_time as date_created
+        from {schema}{table}
+        where {rsi} is not null
+        and {rsi} > 70
+        and quote_asset = 'VNST'  -- generated column, see migrations/0004
+        and open_time = (
+            select max(open_time)
+            from {schema}{table}
+            where open_time >= now() - interval 7 day
+        )
+        order by {rsi} desc
+        limit 100;
+    """,
+    'chart_data': """
+        select symbol,
+            rsi,
+            percentage_change
+        from (
+        SELECT symbol, open_time,
+            {rsi} AS rsi,
+            ({rsi} - lead({rsi}) over (PARTITION by symbol order by open_time desc)) AS percentage_change,
+            row_number() over (PARTITION by symbol order by open_time desc) AS r
+        FROM {schema}{table}
+        WHERE quote_asset = 'VNST'
+            and {rsi} is not null
+            and open_time > :time_limit
+        ) a
+        where r=1 and rsi is not null and percentage_change is not null
+        ORDER BY symbol asc
+    """,
+    'original_pair_list': """
+        SELECT  symbol2 as symbol, MAX(start_date2) AS discovered_symbol_time
+        FROM {schema}{table}
+        GROUP BY symbol2
+        order by symbol2
+    """,
+    'fibonacci_info': """
+        SELECT
+            pm.symbol2 as original_symbol,
+            pm.start_date2 as original_start_date,
+            pm.end_date as original_end_date,
+            pm.prices2 as original_prices,
+            pm.s2_norm as original_fibonacci,
+            pm.symbol1 as similar_symbol,
+            pm.start_date1 as similar_start_date,
+            pm.end_date as similar_end_date,
+            pm.prices1 as similar_prices,
+            pm.s1_norm as similar_fibonacci
+        FROM {schema}{table} pm
+        WHERE pm.symbol2 = :symbol
+        AND pm.start_date2 = (
+            SELECT MAX(start_date2)
+            FROM {schema}{table}
+            WHERE symbol2 = :symbol
+        )
+    """,
+    # ai-analysis
+    'latest_predictions': """
+        SELECT
+            symbol,
+            open_time + interval 2 hour as date,  -- Price is predicted for the end of the next session, mean open_time + 2*period = predicted time
+            last_price as price,
+            next_pred as prediction,
+            ((next_pred - last_price) / last_price) * 100 AS change_percentage
+        FROM
+            {schema}coin_predictions cp
+        WHERE
+            open_time = (SELECT MAX(open_time) FROM {schema}coin_predictions where last_price <> 0)
+            and last_price <> 0
+    """,
+    'predict_validate': """
+        SELECT
+            avg(err) as mae,
+            avg(err_on_atr) as avg_err_rate,
+            avg(true_pred) as accuracy,
+            count(1) as n_trade,
+            sum(true_pred) as true_pred,
+            count(1) - sum(true_pred) as false_pred,
+            GREATEST(max(profit_rate) - 1, 0) as max_profit_rate,
+            GREATEST(1 - min(profit_rate), 0) as max_loss_rate,
+            avg(profit_rate) - 1 as avg_profit_rate
+        from(
+            SELECT p.symbol, r.open_time,
+                (p.next_pred - r.close) as err,
+                abs(p.next_pred - r.close)/r.atr14 as err_on_atr,  -- sai so tren bien dong thi truong
+                CASE WHEN p.pred_direction=r.direction THEN 1 ELSE 0 END as true_pred,
+                case
+                    when p.pred_direction='up' then r.close / p.last_price
+                    when p.pred_direction='down' then p.last_price / r.close
+                    else 1
+                end as profit_rate
+            from(
+                SELECT symbol, (open_time + interval 1 hour) as open_time, last_price, next_pred,
+                case
+                    when next_pred - last_price > 0 then 'up'
+                    when next_pred - last_price < 0 then 'down'
+                    else 'flat'
+                end as pred_direction
+                FROM {schema}coin_predictions cp
+                WHERE open_time >= :time
+                order by open_time desc
+            ) p
+            inner join(
+                SELECT symbol, open, close, atr14, open_time,
+                case
+                    when c_diff_p - c_diff_n > 0 then 'up'
+                    when c_diff_p - c_diff_n < 0 then 'down'
+                    else 'flat'
+                end as direction
+                from {schema}f_coin_signal_1h fcsh
+                where open_time >= :time
+                order by open_time desc
+            ) r on r.open_time = p.open_time and r.symbol = p.symbol
+        ) a
+    """,
+    'predict_validate_symbol': """
+        SELECT
+            avg(err) as mae,
+            avg(err_on_atr) as avg_err_rate,
+            avg(true_pred) as accuracy,
+            count(1) as n_trade,
+            sum(true_pred) as true_pred,
+            count(1) - sum(true_pred) as false_pred,
+            GREATEST(max(profit_rate) - 1, 0) as max_profit_rate,
+            GREATEST(1 - min(profit_rate), 0) as max_loss_rate,
+            avg(profit_rate) - 1 as avg_profit_rate
+        from(
+            SELECT p.symbol, r.open_time,
+                (p.next_pred - r.close) as err,
+                abs(p.next_pred - r.close)/r.atr14 as err_on_atr,  -- sai so tren bien dong thi truong
+                CASE WHEN p.pred_direction=r.direction THEN 1 ELSE 0 END as true_pred,
+                case
+                    when p.pred_direction='up' then r.close / p.last_price
+                    when p.pred_direction='down' then p.last_price / r.close
+                    else 1
+                end as profit_rate
+            from(
+                SELECT symbol, (open_time + interval 1 hour) as open_time, last_price, next_pred,
+                case
+                    when next_pred - last_price > 0 then 'up'
+                    when next_pred - last_price < 0 then 'down'
+                    else 'flat'
+                end as pred_direction
+                FROM {schema}coin_predictions cp
+                WHERE symbol = :symbol and open_time >= :time
+                order by open_time desc
+            ) p
+            inner join(
+                SELECT symbol, open, close, atr14, open_time,
+                case
+                    when c_diff_p > 0 then 'up'
+                    when c_diff_n > 0 then 'down'
+                    else 'flat'
+                end as direction
+                from {schema}f_coin_signal_1h fcsh
+                where symbol = :symbol and open_time >= :time
+                order by open_time desc
+            ) r on r.open_time = p.open_time
+            limit :n_predict
+        ) a
+    """,
+    'predict_chart': """
+        SELECT p.symbol, r.open_time,
+            (r.open_time + interval 1 hour) as close_time,
+            p.next_pred as close_predict,
+            r.open,
+            r.close,
+            r.high,
+            r.low
+        from(
+            SELECT symbol, (open_time + interval 1 hour) as open_time, next_pred
+            FROM {schema}coin_predictions cp
+            WHERE symbol = :symbol and open_time >= :time
+            order by open_time desc
+            limit :n_predict
+        ) p
+        inner join(
+            SELECT symbol, open, close, high, low, open_time
+            from {schema}f_coin_signal_1h fcsh
+            where symbol = :symbol and open_time >= :time
+            order by open_time desc
+            limit :n_predict
+        ) r on r.open_time = p.open_time
+    """,
+    # predict_validate_symbol / predict_chart of many symbols in one query, the last :n_predict rows of each symbol
+    'predict_validate_batch': """
+        SELECT
+            symbol,
+            avg(err) as mae,
+            avg(err_on_atr) as avg_err_rate,
+            avg(true_pred) as accuracy,
+            count(1) as n_trade,
+            sum(true_pred) as true_pred,
+            count(1) - sum(true_pred) as false_pred,
+            GREATEST(max(profit_rate) - 1, 0) as max_profit_rate,
+            GREATEST(1 - min(profit_rate), 0) as max_loss_rate,
+            avg(profit_rate) - 1 as avg_profit_rate
+        from(
+            SELECT p.symbol, r.open_time,
+                (p.next_pred - r.close) as err,
+                abs(p.next_pred - r.close)/r.atr14 as err_on_atr,
+                CASE WHEN p.pred_direction=r.direction THEN 1 ELSE 0 END as true_pred,
+                case
+                    when p.pred_direction='up' then r.close / p.last_price
+                    when p.pred_direction='down' then p.last_price / r.close
+                    else 1
+                end as profit_rate,
+                row_number() over (partition by p.symbol order by r.open_time desc) as r_num
+            from(
+                SELECT symbol, (open_time + interval 1 hour) as open_time, last_price, next_pred,
+                case
+                    when next_pred - last_price > 0 then 'up'
+                    when next_pred - last_price < 0 then 'down'
+                    else 'flat'
+                end as pred_direction
+                FROM {schema}coin_predictions cp
+                WHERE symbol in :symbols and open_time >= :time
+            ) p
+            inner join(
+                SELECT symbol, open, close, atr14, open_time,
+                case
+                    when c_diff_p > 0 then 'up'
+                    when c_diff_n > 0 then 'down'
+                    else 'flat'
+                end as direction
+                from {schema}f_coin_signal_1h fcsh
+                where symbol in :symbols and open_time >= :time
+            ) r on r.symbol = p.symbol and r.open_time = p.open_time
+        ) a
+        where r_num <= :n_predict
+        group by symbol
+    """,
+    'predict_chart_batch': """
+        SELECT p.symbol, r.open_time,
+            (r.open_time + interval 1 hour) as close_time,
+            p.next_pred as close_predict,
+            r.open,
+            r.close,
+            r.high,
+            r.low
+        from(
+            SELECT symbol, (open_time + interval 1 hour) as open_time, next_pred,
+                row_number() over (partition by symbol order by open_time desc) as r_num
+            FROM {schema}coin_predictions cp
+            WHERE symbol in :symbols and open_time >= :time
+        ) p
+        inner join(
+            SELECT symbol, open, close, high, low, open_time,
+                row_number() over (partition by symbol order by open_time desc) as r_num
+            from {schema}f_coin_signal_1h fcsh
+            where symbol in :symbols and open_time >= :time
+        ) r on r.symbol = p.symbol and r.open_time = p.open_time
+        where p.r_num <= :n_predict and r.r_num <= :n_predict
+        order by p.symbol, r.open_time desc
+    """,
+    # search
+    'search_currency': """
+        SELECT c.id, aq.symbol, c.name, aq.price, aq.volume_24h, aq.percent_change_24h, aq.market_cap
+        from (
+        select symbol, price, volume_24h, percent_change_24h, market_cap
+        from {schema}app_quote
+        where symbol rlike :key
+        limit :limit offset :offset
+        ) aq
+        inner join (
+            select id, name, symbol
+            from {schema}tmp_currency
+        ) c on c.symbol = aq.symbol
+    """,
+    # rolling window of a signal table, loaded by the in-memory market store (app/core/market_store.py)
+    # the newest bar is read again on every poll, it is rewritten until it closes
+    'market_store_rows': """
+        select symbol, open_time, close, high, low, rsi7, rsi14, update_time
+        from {schema}{table}
+        where open_time >= coalesce(:since, now() - interval :hours hour)
+        order by open_time
+    """,
+    # snapshots, small "latest per symbol" tables kept by app/db/snapshots.py
+    'snap_latest_prices': """
+        select left(symbol, char_length(symbol) - 4) as coin, close as price,
+               round(((close - ref_close) * 100 / ref_close), 2) as price_change
+        from {schema}snap_latest_price
+        where open_time >= now() - interval 100 hour
+        and ref_open_time >= now() - interval 20 day
+    """,
+    'snap_coin_prices': """
+        select symbol, price, percent_change, list_prices
+        from {schema}snap_price_sparkline
+        order by symbol
+    """,
+    'snap_original_pair_list': """
+        select symbol, discovered_time as discovered_symbol_time
+        from {schema}snap_pattern_latest
+        where source = :source
+        order by symbol
+    """,
+    'snap_source_max': """
+        select max({column}) from {schema}{table}
+    """,
+    'snap_watermark_get': """
+        select watermark from {schema}snap_watermark where name = :name
+    """,
+    'snap_watermark_set': """
+        insert into {schema}snap_watermark (name, watermark) values (:name, :watermark)
+        on duplicate key update watermark = values(watermark)
+    """,
+    # updated_at is the last successful check of a snapshot, with or without new rows
+    'snap_watermark_touch': """
+        update {schema}snap_watermark set updated_at = current_timestamp where name = :name
+    """,
+    'snap_watermark_age': """
+        select count(*) as n, timestampdiff(second, min(updated_at), now()) as age
+        from {schema}snap_watermark
+        where name in :names
+    """,
+    # last 5m close of each symbol with a new bar since the watermark
+    # (in an insert ... select the update clause sees the select columns too, the target columns are qualified)
+    'snap_latest_close_upsert': """
+        insert into {schema}snap_latest_price (symbol, close, open_time)
+        select t.symbol, t.close, t.open_time
+        from {schema}f_coin_signal_5m t
+        join (
+            select symbol, max(open_time) as open_time
+            from {schema}f_coin_signal_5m
+            where open_time > greatest(:since, now() - interval 100 hour)
+            group by symbol
+        ) m on m.symbol = t.symbol and m.open_time = t.open_time
+        on duplicate key update
+            close = if(values(open_time) >= {schema}snap_latest_price.open_time or {schema}snap_latest_price.open_time is null,
+                       values(close), {schema}snap_latest_price.close),
+            open_time = greatest(coalesce({schema}snap_latest_price.open_time, values(open_time)), values(open_time))
+    """,
+    # daily reference close of each symbol
+    'snap_ref_close_upsert': """
+        insert into {schema}snap_latest_price (symbol, ref_close, ref_open_time)
+        select t.symbol, t.close, t.open_time
+        from {schema}f_coin_signal_1d t
+        join (
+            select symbol, max(open_time) as open_time
+            from {schema}f_coin_signal_1d
+            where open_time > greatest(:since, now() - interval 20 day)
+            group by symbol
+        ) m on m.symbol = t.symbol and m.open_time = t.open_time
+        on duplicate key update
+            ref_close = if(values(ref_open_time) >= {schema}snap_latest_price.ref_open_time or {schema}snap_latest_price.ref_open_time is null,
+                           values(ref_close), {schema}snap_latest_price.ref_close),
+            ref_open_time = greatest(coalesce({schema}snap_latest_price.ref_open_time, values(ref_open_time)), values(ref_open_time))
+    """,
+    # 24h sparkline, rebuilt once per new 5m bar instead of once per request
+    'snap_sparkline_upsert': """
+        insert into {schema}snap_price_sparkline (symbol, price, percent_change, list_prices, open_time)
+        WITH MaxTime AS (
+            SELECT
+                MAX(open_time) AS max_open_time,
+                EXTRACT(MINUTE FROM MAX(open_time)) AS max_minute
+            FROM
+                {schema}coin_prices_5m
+        ),
+        FilteredTimes AS (
+            SELECT symbol, open_time, close
+            FROM {schema}coin_prices_5m
+            WHERE
+                open_time >= (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime)
+                AND EXTRACT(MINUTE FROM open_time) = (SELECT max_minute FROM MaxTime)
+        ),
+        MaxTimePrices AS (
+            SELECT
+                symbol,
+                MAX(CASE WHEN open_time = (SELECT max_open_time FROM MaxTime) THEN close END) AS close_at_max_time,
+                MAX(CASE WHEN open_time = (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime) THEN close END) AS close_at_prev_day
+            FROM {schema}coin_prices_5m
+            WHERE
+                open_time IN ((SELECT max_open_time FROM MaxTime), (SELECT max_open_time - INTERVAL 1 DAY FROM MaxTime))
+            GROUP BY symbol
+        )
+        SELECT
+            ft.symbol,
+            mp.close_at_max_time,
+            ROUND(((mp.close_at_max_time - mp.close_at_prev_day) / mp.close_at_prev_day) * 100, 2),
+            GROUP_CONCAT(ft.close ORDER BY ft.open_time SEPARATOR ', '),
+            (SELECT max_open_time FROM MaxTime)
+        FROM FilteredTimes ft
+        JOIN MaxTimePrices mp ON ft.symbol = mp.symbol
+        GROUP BY ft.symbol, mp.close_at_max_time, mp.close_at_prev_day
+        on duplicate key update
+            price = values(price),
+            percent_change = values(percent_change),
+            list_prices = values(list_prices),
+            open_time = values(open_time)
+    """,
+    # symbols without a bar in the last rebuild
+    'snap_sparkline_prune': """
+        delete from {schema}snap_price_sparkline where open_time < :open_time
+    """,
+    # last discovery time of each original symbol of a pattern table
+    'snap_pattern_upsert': """
+        insert into {schema}snap_pattern_latest (source, symbol, discovered_time)
+        select :source, symbol2, max(start_date2)
+        from {schema}{table}
+        where start_date2 > :since
+        group by symbol2
+        on duplicate key update discovered_time = greatest({schema}snap_pattern_latest.discovered_time, values(discovered_time))
+    """,
+    # prediction accuracy partial sums per symbol per hour (hour of the real candle), rebuilt for the hours since :since
+    'snap_predict_rollup_upsert': """
+        insert into {schema}snap_predict_rollup (symbol, open_time, n_pred, n_err, sum_err, n_err_on_atr, sum_err_on_atr,
+                                                 true_pred, n_profit, sum_profit_rate, min_profit_rate, max_profit_rate)
+        select symbol, open_time, count(1), count(err), sum(err), count(err_on_atr), sum(err_on_atr),
+               sum(true_pred), count(profit_rate), sum(profit_rate), min(profit_rate), max(profit_rate)
+        from(
+            SELECT p.symbol, r.open_time,
+                (p.next_pred - r.close) as err,
+                abs(p.next_pred - r.close)/r.atr14 as err_on_atr,
+                CASE WHEN p.pred_direction=r.direction THEN 1 ELSE 0 END as true_pred,
+                case
+                    when p.pred_direction='up' then r.close / p.last_price
+                    when p.pred_direction='down' then p.last_price / r.close
+                    else 1
+                end as profit_rate
+            from(
+                SELECT symbol, (open_time + interval 1 hour) as open_time, last_price, next_pred,
+                case
+                    when next_pred - last_price > 0 then 'up'
+                    when next_pred - last_price < 0 then 'down'
+                    else 'flat'
+                end as pred_direction
+                FROM {schema}coin_predictions cp
+                WHERE open_time >= :since - interval 1 hour
+            ) p
+            inner join(
+                SELECT symbol, open, close, atr14, open_time,
+                case
+                    when c_diff_p - c_diff_n > 0 then 'up'
+                    when c_diff_p - c_diff_n < 0 then 'down'
+                    else 'flat'
+                end as direction
+                from {schema}f_coin_signal_1h fcsh
+                where open_time >= :since
+            ) r on r.open_time = p.open_time and r.symbol = p.symbol
+        ) a
+        group by symbol, open_time
+        on duplicate key update
+            n_pred = values(n_pred), n_err = values(n_err), sum_err = values(sum_err),
+            n_err_on_atr = values(n_err_on_atr), sum_err_on_atr = values(sum_err_on_atr),
+            true_pred = values(true_pred), n_profit = values(n_profit), sum_profit_rate = values(sum_profit_rate),
+            min_profit_rate = values(min_profit_rate), max_profit_rate = values(max_profit_rate)
+    """,
+    # predict_validate from the rollup, same metrics: averages are sums / counts of non null values
+    'snap_predict_validate': """
+        SELECT
+            sum(sum_err) / sum(n_err) as mae,
+            sum(sum_err_on_atr) / sum(n_err_on_atr) as avg_err_rate,
+            sum(true_pred) / sum(n_pred) as accuracy,
+            sum(n_pred) as n_trade,
+            sum(true_pred) as true_pred,
+            sum(n_pred) - sum(true_pred) as false_pred,
+            GREATEST(max(max_profit_rate) - 1, 0) as max_profit_rate,
+            GREATEST(1 - min(min_profit_rate), 0) as max_loss_rate,
+            sum(sum_profit_rate) / sum(n_profit) - 1 as avg_profit_rate
+        from {schema}snap_predict_rollup
+        where open_time >= :time + interval 1 hour
+        having count(1) > 0
+    """,
+    # trade bot, own schemas
+    'bot_open_trades': """
+        SELECT  a.token, a.direction, a.entry_price, b.price current_price, a.position_size, a.invested_amount, a.position_size*b.price current_value, a.entry_time
+        from (
+            SELECT pair, LEFT(pair, char_length(pair)-4) token, direction, entry_price, exit_price, invested_amount, net_return, profit, position_size, entry_time, exit_time
+            FROM trade_bot.trades t
+            where bot_id = :bot_id and status='open' and (:start_time is null or entry_time > :start_time)
+            order by entry_time desc, id desc
+            limit :limit offset :offset
+        ) a left join (
+            select symbol, price
+            from (
+                select symbol, price, open_time,
+                    row_number() over (partition by symbol order by open_time desc) r
+                from(
+                    select symbol, `close` as price, open_time
+                    from proddb.coin_prices_5m cpm
+                    where open_time > UNIX_TIMESTAMP(NOW()) - 1800  -- 30 p
+                ) b
+            ) b
+            where r=1
+        ) b on b.symbol = a.pair
+        order by a.entry_time desc
+    """,
+    # one page, newest exit first, after the (exit_time, id) of the cursor: seek on (bot_id, exit_time, id), no offset
+    'bot_closed_trades': """
+        SELECT id, LEFT(pair, char_length(pair)-4) token, direction, entry_price, exit_price, invested_amount, net_return, profit, position_size, entry_time, exit_time
+        FROM trade_bot.trades t
+        where bot_id = :bot_id and status='closed' and (:start_time is null or entry_time > :start_time)
+        and (:cursor_time is null or exit_time < :cursor_time or (exit_time = :cursor_time and id < :cursor_id))
+        order by exit_time desc, id desc
+        limit :limit
+    """,
+    'bot_closed_summary': """
+        SELECT count(*) trades, coalesce(sum(profit >= 0), 0) wins, coalesce(sum(profit < 0), 0) losses, coalesce(sum(profit), 0) total_profit
+        FROM trade_bot.trades t
+        where bot_id = :bot_id and status='closed' and (:start_time is null or entry_time > :start_time)
+    """,
+}
+
+# list params of a query, bound as `in :name` and expanded to one placeholder per value
+EXPANDING = {
+    'predict_validate_batch': ('symbols',),
+    'predict_chart_batch': ('symbols',),
+    'snap_watermark_age': ('names',),
+}
+# (name, variant) -> statement, built on first use and reused by every request
+_STATEMENTS: dict[tuple, TextClause] = {}
+
+
+def get_query(name: str, **variant: str) -> TextClause:
+    """ statement of a registered query, e.g. get_query('top_over_sold', table='f_coin_signal_1h', rsi='rsi7')
+    the text is the same for every request of a variant, so sqlalchemy reuse its compiled form
+    variant values must be known identifiers (table / column names), never request values
+    """
+    key = (name, tuple(sorted(variant.items())))
+    statement = _STATEMENTS.get(key)
+    if statement is None:
+        for value in variant.values():
+            if value not in IDENTIFIERS:
+                raise ValueError(f"Unknown identifier in query {name}: {value}")
+        statement = text(QUERIES[name].format(schema=SCHEMA, **variant))
+        if name in EXPANDING:
+            statement = statement.bindparams(*(bindparam(param, expanding=True) for param in EXPANDING[name]))
+        _STATEMENTS[key] = statement
+    return statement
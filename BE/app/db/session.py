@@ -1,15 +1,125 @@
+import itertools, time
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 from app.core.config import settings
 from fastapi import HTTPException
 
+# pool of every engine, per worker
+POOL_ARGS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,   # drop connections before mysql close them
+    pool_pre_ping=settings.DB_POOL_PRE_PING, # test a connection before use, reconnect if it is dead
+)
+# secs a replica that failed to connect is skipped
+REPLICA_RETRY = 30
+
 # Create the SQLAlchemy engine
 engine = create_engine(settings.SQLALCHEMY_DATABASE_URL,
                        connect_args={"connect_timeout": 1},
+                       **POOL_ARGS,
+)
+# async engine (aiomysql): a request waiting on mysql hold a pooled connection, not a threadpool slot
+async_engine = create_async_engine(settings.SQLALCHEMY_ASYNC_DATABASE_URL,
+                                   connect_args={"connect_timeout": 1},
+                                   **POOL_ARGS,
 )
+# read replicas, same user and database as the primary
+replica_engines = [
+    create_async_engine(async_engine.url.set(host=host, port=int(port or 3306)),
+                        connect_args={"connect_timeout": 1},
+                        **POOL_ARGS,
+    )
+    for host, _, port in (server.strip().partition(':') for server in settings.MYSQL_REPLICA_SERVERS.split(','))
+    if host
+]
 
 # Create a configured "Session" class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=async_engine,
+                                 class_=AsyncSession, expire_on_commit=False)
+
+
+class PoolStats:
+    """ time spent waiting for a connection of one engine (pool checkout + connect), in this worker
+    """
+    def __init__(self):
+        self.checkouts = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.wait_max_seconds = 0.0
+        self.down_until = 0.0   # replica skipped until this timestamp
+
+    def record(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.wait_max_seconds = max(self.wait_max_seconds, seconds)
+
+
+pool_stats: dict[AsyncEngine, PoolStats] = {e: PoolStats() for e in [async_engine, *replica_engines]}
+_next_replica = itertools.count()
+
+
+async def connect(db: AsyncSession, engine: AsyncEngine) -> None:
+    """ take the connection of a session now, so the wait is measured and a dead server found before the query
+    """
+    stats = pool_stats[engine]
+    start = time.perf_counter()
+    try:
+        await db.connection()
+    except Exception:
+        stats.failures += 1
+        raise
+    stats.record(time.perf_counter() - start)
+
+
+async def read_session() -> AsyncSession:
+    """ session on the next available replica (round robin), the primary if there is none or none answer
+    """
+    now = time.time()
+    first = next(_next_replica)
+    for i in range(len(replica_engines)):
+        replica = replica_engines[(first + i) % len(replica_engines)]
+        if pool_stats[replica].down_until > now:
+            continue
+        db = AsyncSessionLocal(bind=replica)
+        try:
+            await connect(db, replica)
+            return db
+        except Exception as e:
+            print("Replica unavailable", replica.url.host, e)
+            pool_stats[replica].down_until = now + REPLICA_RETRY
+            await db.close()
+    db = AsyncSessionLocal()
+    try:
+        await connect(db, async_engine)
+    except Exception as e:
+        print(e)
+        await db.close()
+        raise HTTPException(status_code=500, detail="Query data error")
+    return db
+
+
+def get_pool_stats() -> dict:
+    """ gauges of every async engine pool: size, checked out, overflow, checkout wait time
+    """
+    result = {}
+    for name, e in [('primary', async_engine), *((f"replica:{r.url.host}:{r.url.port}", r) for r in replica_engines)]:
+        stats = pool_stats[e]
+        result[name] = {
+            'size': e.pool.size(),
+            'checked_out': e.pool.checkedout(),
+            'checked_in': e.pool.checkedin(),
+            'overflow': max(0, e.pool.overflow()),  # connections opened above pool_size
+            'checkouts': stats.checkouts,
+            'failures': stats.failures,
+            'avg_wait_ms': round(stats.wait_seconds / stats.checkouts * 1000, 3) if stats.checkouts else 0,
+            'max_wait_ms': round(stats.wait_max_seconds * 1000, 3),
+            'down': stats.down_until > time.time(),
+        }
+    return result
 
 # do not change the order of the code below
 # Dependency that can be used in routes to get the session
@@ -17,8 +127,42 @@ def get_db() -> Session  |  HTTPException:
     db = SessionLocal()  # generate a new SessionLocal
     try:
         yield db
+    except HTTPException:
+        # raised by the endpoint itself (e.g. 404), keep it
+        raise
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail="Query data error")
     finally:
         db.close()
+
+# async version of get_db, for `async def` endpoints
+async def get_async_db() -> AsyncSession  |  HTTPException:
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail="Query data error")
+    finally:
+        await db.close()
+
+# read only queries (analytics endpoints): served by a replica when there is one
+async def get_read_db() -> AsyncSession  |  HTTPException:
+    db = await read_session()
+    try:
+        yield db
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail="Query data error")
+    finally:
+        await db.close()
+
+
+async def close_db() -> None:
+    for e in [async_engine, *replica_engines]:
+        await e.dispose()
@@ -0,0 +1,203 @@
+import asyncio
+from datetime import datetime, timedelta
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.cache_invalidation import CACHE_INVALIDATE_CHANNEL
+from app.core.redis_client import breaker, RedisUnavailable
+from app.core.single_flight import RedisLease
+from app.db.queries import PATTERN_TABLES, get_query
+from app.db.session import AsyncSessionLocal
+
+# late rows up to this much older than the watermark are still picked up, upserts are idempotent
+SNAPSHOT_OVERLAP = timedelta(hours=1)
+# source table -> snapshots to refresh when it is updated
+SNAPSHOT_TRIGGERS = {
+    'f_coin_signal_5m': ['latest_close'],
+    'f_coin_signal_1d': ['ref_close'],
+    'f_coin_signal_1h': ['predict_rollup'],
+    'coin_predictions': ['predict_rollup'],
+    'coin_prices_5m': ['sparkline'],
+    **{table: ['pattern:' + table] for table in PATTERN_TABLES.values()},
+}
+# snapshot read query -> refreshes it is built by, formatted with the read params
+SNAPSHOT_WATERMARKS = {
+    'snap_latest_prices': ('latest_close', 'ref_close'),
+    'snap_coin_prices': ('sparkline',),
+    'snap_predict_validate': ('predict_rollup',),
+    'snap_original_pair_list': ('pattern:{source}',),
+}
+
+
+def snapshot_max_age() -> float:
+    """ secs without a successful refresh after which a snapshot is not served
+    """
+    return max(settings.SNAPSHOT_INTERVAL * 5, 60)
+
+
+async def read_snapshot(db: AsyncSession, name: str, params: dict | None = None) -> list | None:
+    """ rows of a snapshot query, None if snapshots are disabled, not built yet, too old or fail
+    the caller then run the aggregate query on the source tables
+    """
+    if not settings.SNAPSHOTS:
+        return None
+    watermarks = [watermark.format(**(params or {})) for watermark in SNAPSHOT_WATERMARKS.get(name, ())]
+    try:
+        if watermarks:
+            # the maintainer may be failing or stuck, its errors are only printed
+            row = (await db.execute(get_query('snap_watermark_age'), {'names': watermarks})).one()
+            if row.n < len(watermarks) or row.age is None or row.age > snapshot_max_age():
+                return None
+        result = (await db.execute(get_query(name), params or {})).fetchall()
+    except Exception as e:  # e.g. table not created yet on this server
+        print("Snapshot read failed", name, e)
+        await db.rollback()
+        return None
+    return result or None
+
+
+class SnapshotMaintainer:
+    """ keep the snapshot tables up to date, a refresh only read the rows newer than its watermark
+    run on table update notifications (writers publish on the cache invalidation channel)
+    and every SNAPSHOT_INTERVAL secs for writers that do not publish.
+    every worker run one, a redis lease make one worker do each refresh.
+    the tables are created by the migrations (python -m app.db.migrate), until then refreshes fail
+    and the endpoints read the source tables
+    """
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self.lease = RedisLease(redis, ttl=60, prefix='lease:snapshot:')
+        self.task: asyncio.Task | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    async def get_watermark(self, db: AsyncSession, name: str) -> str | None:
+        return (await db.execute(get_query('snap_watermark_get'), {'name': name})).scalar()
+
+    async def set_watermark(self, db: AsyncSession, name: str, value) -> None:
+        await db.execute(get_query('snap_watermark_set'), {'name': name, 'watermark': str(value)})
+
+    async def incremental(self, db: AsyncSession, name: str, source: str, column: str, query: str, **variant) -> bool:
+        """ fold the rows of `source` newer than the watermark into the snapshot, return False if there is none
+        """
+        latest = (await db.execute(get_query('snap_source_max', table=source, column=column))).scalar()
+        watermark = await self.get_watermark(db, name)
+        if latest is None or str(latest) == watermark:
+            return False
+        since = datetime.fromisoformat(watermark) - SNAPSHOT_OVERLAP if watermark else datetime(1970, 1, 1)
+        await db.execute(get_query(query, **variant), {'since': since, 'source': source})
+        await self.set_watermark(db, name, latest)
+        return True
+
+    async def refresh_sparkline(self, db: AsyncSession) -> bool:
+        """ the 24h window move with every new bar, rebuild it once per bar
+        """
+        latest = (await db.execute(get_query('snap_source_max', table='coin_prices_5m', column='open_time'))).scalar()
+        if latest is None or str(latest) == await self.get_watermark(db, 'sparkline'):
+            return False
+        await db.execute(get_query('snap_sparkline_upsert'))
+        await db.execute(get_query('snap_sparkline_prune'), {'open_time': latest})
+        await self.set_watermark(db, 'sparkline', latest)
+        return True
+
+    async def refresh_predict_rollup(self, db: AsyncSession) -> bool:
+        """ an hour of the rollup change with its candle and with the predictions of it, each source has a watermark
+        a prediction of open_time t is checked by the candle of t + 1 hour
+        """
+        since, moved = None, []
+        for name, source, shift in (('predict_rollup', 'f_coin_signal_1h', timedelta(0)),
+                                    ('predict_rollup:predictions', 'coin_predictions', timedelta(hours=1))):
+            latest = (await db.execute(get_query('snap_source_max', table=source, column='open_time'))).scalar()
+            watermark = await self.get_watermark(db, name)
+            if latest is None or str(latest) == watermark:
+                continue
+            start = datetime.fromisoformat(watermark) + shift - SNAPSHOT_OVERLAP if watermark else datetime(1970, 1, 1)
+            since = start if since is None else min(since, start)
+            moved.append((name, latest))
+        if since is None:
+            return False
+        await db.execute(get_query('snap_predict_rollup_upsert'), {'since': since})
+        for name, latest in moved:
+            await self.set_watermark(db, name, latest)
+        return True
+
+    async def refresh(self, name: str) -> bool:
+        """ refresh one snapshot: latest_close | ref_close | predict_rollup | sparkline | pattern:<table>
+        """
+        token = None
+        try:
+            token = await breaker.call(lambda: self.lease.acquire(name))
+            if token is None:
+                return False  # another worker is on it
+        except RedisUnavailable:
+            pass
+        except Exception as e:  # redis unavailable -> the upserts are idempotent, do it anyway
+            print("Failed to get snapshot lease", e)
+        try:
+            async with AsyncSessionLocal() as db:
+                if name == 'latest_close':
+                    changed = await self.incremental(db, name, 'f_coin_signal_5m', 'open_time', 'snap_latest_close_upsert')
+                    snapshot = 'snap_latest_price'
+                elif name == 'ref_close':
+                    changed = await self.incremental(db, name, 'f_coin_signal_1d', 'open_time', 'snap_ref_close_upsert')
+                    snapshot = 'snap_latest_price'
+                elif name == 'predict_rollup':
+                    # a prediction is checked when the candle of its next hour land, either may land last
+                    changed = await self.refresh_predict_rollup(db)
+                    snapshot = 'snap_predict_rollup'
+                elif name == 'sparkline':
+                    changed = await self.refresh_sparkline(db)
+                    snapshot = 'snap_price_sparkline'
+                else:
+                    table = name.removeprefix('pattern:')
+                    changed = await self.incremental(db, name, table, 'start_date2', 'snap_pattern_upsert', table=table)
+                    snapshot = 'snap_pattern_latest'
+                # the snapshot is up to date now, read_snapshot serve it while this is recent
+                await db.execute(get_query('snap_watermark_touch'), {'name': name})
+                await db.commit()
+        finally:
+            if token is not None:
+                try:
+                    await breaker.call(lambda: self.lease.release(name, token))
+                except Exception as e:
+                    print("Failed to release snapshot lease", e)
+        if changed:
+            print("Snapshot refreshed", name)
+            # cached responses read from the snapshot are dropped in every worker
+            try:
+                await breaker.call(lambda: self.redis.publish(CACHE_INVALIDATE_CHANNEL, snapshot))
+            except Exception as e:
+                print("Failed to publish snapshot update", e)
+        return changed
+
+    async def refresh_all(self) -> None:
+        names = ['latest_close', 'ref_close', 'predict_rollup', 'sparkline', *('pattern:' + table for table in PATTERN_TABLES.values())]
+        for name in names:
+            try:
+                await self.refresh(name)
+            except Exception as e:
+                print("Failed to refresh snapshot", name, e)
+
+    def on_table_updated(self, table: str) -> None:
+        """ invalidation listener callback: a writer updated `table`
+        """
+        for name in SNAPSHOT_TRIGGERS.get(table, ()):
+            task = asyncio.create_task(self.refresh(name))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self) -> None:
+        while True:
+            await self.refresh_all()
+            await asyncio.sleep(settings.SNAPSHOT_INTERVAL)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        for task in [self.task, *self.tasks]:
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
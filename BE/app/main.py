@@ -1,10 +1,9 @@
 from fastapi import FastAPI
 from datetime import datetime
-import uvicorn, secrets
+import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 
-from fastapi import Depends, FastAPI, HTTPException, status
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi import Depends, FastAPI
 from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 from fastapi.staticfiles import StaticFiles
@@ -16,6 +15,14 @@ from app.api.dev import login_page
 from app.api.sessions.auth import auth
 from app.api.sessions.auth import google
 from app.core.config import settings
+from app.core.security import doc_auth
+from app.core.redis_client import close_redis, get_redis
+from app.core.cache import get_tagged_tables
+from app.core.cache_warmer import CacheWarmer
+from app.core.cache_invalidation import InvalidationListener
+from app.core.market_store import market_store
+from app.db.session import close_db
+from app.db.snapshots import SnapshotMaintainer
 
 # Define the FastAPI application instance
 app = FastAPI(
@@ -28,6 +35,31 @@ app = FastAPI(
 
 # cache middleware
 app.add_middleware(CacheRequestMiddleware)
+cache_warmer = CacheWarmer(app)
+cache_invalidation = InvalidationListener(get_redis(), get_tagged_tables())
+snapshots = SnapshotMaintainer(get_redis())
+
+@app.on_event("startup")
+async def startup_cache():
+    cache_invalidation.start()
+    if settings.CACHE_WARMER:
+        cache_warmer.start()
+    if settings.SNAPSHOTS:
+        cache_invalidation.add_callback(snapshots.on_table_updated)
+        snapshots.start()
+    if settings.MARKET_STORE:
+        cache_invalidation.add_callback(market_store.on_table_updated)
+        market_store.start()
+
+@app.on_event("shutdown")
+async def shutdown_cache():
+    await cache_warmer.stop()
+    await snapshots.stop()
+    await market_store.stop()
+    await cache_invalidation.stop()
+    await close_redis()
+    await close_db()
+
 # session middleware
 app.add_middleware(SessionMiddleware, 
                    secret_key=settings.SESSION_SECRET_KEY,
@@ -47,17 +79,6 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory=settings.STATIC_FOLDER), name="static")
 # templates = Jinja2Templates(directory="templates")
 
-security = HTTPBasic()
-def doc_auth(credentials: HTTPBasicCredentials = Depends(security)):
-    correct_password = secrets.compare_digest(credentials.password, settings.DOC_PASSWORD)
-    if not (correct_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect password",
-            headers={"WWW-Authenticate": "Basic"},
-        )
-    return credentials.username
-
 @app.get("/docs", include_in_schema=False)
 async def get_swagger_documentation(username: str = Depends(doc_auth)):
     return get_swagger_ui_html(openapi_url="/openapi.json", title="docs")
@@ -79,6 +100,7 @@ app.include_router(api_v1.ai_analysis.router, prefix="/api/v1/ai-analysis")
 app.include_router(api_v1.al_trade.router, prefix="/api/v1/al-trade")
 app.include_router(api_v1.search.router, prefix="/api/v1/search")
 app.include_router(api_v2.agent.router, prefix=f"/api/v1/agent")
+app.include_router(api_v1.admin.router, prefix="/api/v1/admin")
 
 
 # swap page
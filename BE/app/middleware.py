@@ -1,118 +1,448 @@
-import json
-from redis import Redis, ConnectionPool, SSLConnection, Connection
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.concurrency import iterate_in_threadpool
-from app.core.cache import CACHE_TYPE, CACHE_PATHS, get_cache_type
+import asyncio, time
+from email.utils import formatdate
+from typing import Awaitable, Callable
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.cache import (CACHE_TYPE, get_cache_route, get_cache_key, get_cache_tables, get_expire_at,
+                            get_negative_cache_type, is_negative_result, refresh_early)
+from app.core.cache_invalidation import tag_key, TAG_TTL
+from app.core.cache_stats import cache_stats, route_keys_key
+from app.core.cache_entry import CacheEntry, compress, make_etag
 from app.core.config import settings
+from app.core.redis_client import get_redis, breaker, RedisUnavailable
+from app.core.local_cache import local_cache
+from app.core.single_flight import single_flight, RedisLease
 
-class CacheRequestMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
-        self.pool=ConnectionPool(
-            host=settings.REDIS_HOST, 
-            port=settings.REDIS_PORT,
-            socket_connect_timeout = 0.05,  # secs time to check connection
-            socket_timeout=5,               # secs time to keep socket open
-            retry_on_timeout = False,
-            max_connections=settings.REDIS_MAX_CONNECTIONS,
-            connection_class=SSLConnection if settings.REDIS_SSL else Connection  # SSLConnection for secure connection
-            )
-
-    async def dispatch(self, request: Request, call_next):
-        method = request.method
+JSON_HEADERS = {'content-type': 'application/json'}
+# headers kept on a 304 response
+CACHE_HEADERS = ('etag', 'cache-control', 'expires', 'vary')
+
+
+def not_modified(if_none_match: str | None, etag: str | None) -> bool:
+    """ check If-None-Match against the entry ETag (weak comparison)
+    """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag.removeprefix('W/') in tags
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """ check an Accept-Encoding header, e.g. "gzip, deflate, br;q=0.5" accept gzip and br
+    """
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip() in (encoding, '*'):
+            q = params.strip()
+            if not q.startswith('q='):
+                return True
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def entry_cache_type(entry: CacheEntry, route_key: str, cache_type: str) -> str:
+    """ policy an entry was stored with, the negative policy of the route for 404 and empty results
+    """
+    if entry.negative:
+        return get_negative_cache_type(route_key) or cache_type
+    return cache_type
+
+
+async def send_response(send: Send, status_code: int, headers: dict, body: bytes = b'') -> None:
+    """ send a complete response in two messages, no Response object
+    """
+    raw_headers = [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]
+    if status_code not in (204, 304):
+        raw_headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def replay(body: bytes, receive: Receive | None = None) -> Receive:
+    """ receive callable giving the already read body to the app again
+    then the client messages (disconnect), or nothing if there is no client
+    """
+    sent = False
+
+    async def receive_body() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        if receive is not None:
+            return await receive()
+        # nobody is waiting on the other side, never disconnect
+        await asyncio.Event().wait()
+
+    return receive_body
+
+
+class CacheRequestMiddleware:
+    """ pure asgi: uncached routes go straight to the app, for cached ones the response is
+    streamed to the client and kept in a buffer at the same time
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # async client on the shared pool, no call here blocks the event loop
+        self.redis = get_redis()
+        self.lease = RedisLease(self.redis, ttl=settings.CACHE_LEASE_TTL)
+        # keep references of background refresh tasks until they finish
+        self.tasks: set[asyncio.Task] = set()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
         # turn all query path to lower case make it case insensitive -> do it in function too
-        path = request.url.path.lower().strip()
-        param = str(request.query_params if method == 'GET' else await request.body())
-        cache_key = self.get_key(method, path, param)
-        cache_type = get_cache_type(method, path)
-        # print("====",param, method, path, cache_key, cache_type)
+        path = scope['path'].lower().strip()
+        route = get_cache_route(method, path)
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        route_key, cache_type = route
+
+        request_headers = Headers(scope=scope)
+        if_none_match = request_headers.get('if-none-match')
+        # only a cached non-GET route read the body, it is replayed to the app
+        body = await read_body(receive) if method != 'GET' else b''
+        query_items = QueryParams(scope.get('query_string', b'')).multi_items()
+        cache_key = get_cache_key(method, path, route_key, query_items, body)
+        # print("====", method, path, cache_key, cache_type)
+
+        streamed = False  # the response went to the client while it was computed
+
+        async def compute(prepare):
+            nonlocal streamed
+            streamed = True
+            return await self.call_and_tee(scope, replay(body, receive), send, prepare, if_none_match)
+
+        if scope.get('cache.refresh'):
+            # internal request from the cache warmer: recompute and store, unless another worker
+            # (or this one before a restart) already refreshed the entry
+            entry = await self.get_cache_data(cache_key)
+            if entry is not None and (entry.fresh_until is None
+                                      or entry.fresh_until > time.time() + scope.get('cache.refresh_lead', 0)):
+                await send_response(send, 204, {})
+                return
+            result = await self.fetch_and_cache(cache_key, route_key, cache_type, compute, wait=False)
+            if result is None:  # another worker is refreshing this key
+                await send_response(send, 204, {})
+            return
 
         # check cache
-        if cache_type is not None:
-            cache = self.get_cache_data(cache_key)
-            if cache is not None:
-                # print("Cache hit")
-                return Response(
-                    content=cache,
-                    status_code=200,
-                    # headers=dict(response.headers), 
-                    media_type="application/json"
-                    )
-        # process request -> response
+        start = time.perf_counter()
+        entry = await self.get_cache_data(cache_key)
+        lookup_seconds = time.perf_counter() - start
+        now = time.time()
+        if entry is not None and entry.is_servable(now):
+            # print("Cache hit")
+            fresh = entry.is_fresh(now)
+            cache_stats.record_lookup(route_key, lookup_seconds, 'hit' if fresh else 'stale')
+            if not fresh or refresh_early(entry_cache_type(entry, route_key, cache_type), entry.fresh_until, entry.delta, now):
+                # stale-while-revalidate or early refresh: serve now, refresh in background
+                self.refresh_in_background(scope, body, cache_key, route_key, cache_type)
+            headers = self.cache_headers(entry, entry_cache_type(entry, route_key, cache_type), now)
+            if entry.status == 200 and not_modified(if_none_match, entry.etag):
+                await send_response(send, 304, headers)
+                return
+            await self.send_cached(send, entry, request_headers.get('accept-encoding', ''), headers)
+            return
+
+        # miss: identical requests in this worker wait for one computation,
+        # the one computing stream it to its client, the others send the result
+        cache_stats.record_lookup(route_key, lookup_seconds, 'miss')
+        status_code, headers, body = await single_flight.do(
+            cache_key, lambda: self.fetch_and_cache(cache_key, route_key, cache_type, compute)
+        )
+        if streamed:
+            return
+        if status_code == 200 and not_modified(if_none_match, headers.get('etag')):
+            await send_response(send, 304, {k: v for k, v in headers.items() if k in CACHE_HEADERS})
+            return
+        await send_response(send, status_code, {k: v for k, v in headers.items() if k != 'content-length'}, body)
+
+    def cache_headers(self, entry: CacheEntry, cache_type: str, now: float) -> dict:
+        """ ETag and freshness headers derived from the entry and its cache policy
+        """
+        headers = {}
+        if entry.etag is not None:
+            headers['etag'] = entry.etag
+        if entry.encoding is not None:
+            # stored compressed, the body sent depend on Accept-Encoding (on a 304 too)
+            headers['vary'] = 'Accept-Encoding'
+        if entry.fresh_until is None:
+            # no expire: clients keep it but revalidate with If-None-Match
+            headers['cache-control'] = 'no-cache'
+            return headers
+        cache_control = f"public, max-age={max(0, int(entry.fresh_until - now))}"
+        stale = CACHE_TYPE[cache_type].get('stale')
+        if stale:
+            cache_control += f", stale-while-revalidate={stale}"
+        headers['cache-control'] = cache_control
+        headers['expires'] = formatdate(entry.fresh_until, usegmt=True)
+        return headers
+
+    async def send_cached(self, send: Send, entry: CacheEntry, accept_encoding: str = '', headers: dict | None = None) -> None:
+        """ send the stored compressed body as is if the client accept its encoding, else decompress it
+        negative entries are sent with their stored status (404)
+        """
+        headers = {**JSON_HEADERS, **(headers or {})}
+        if entry.encoding is not None and accepts_encoding(accept_encoding, entry.encoding):
+            headers['content-encoding'] = entry.encoding
+            await send_response(send, entry.status, headers, entry.body)
+            return
+        await send_response(send, entry.status, headers, entry.plain_body())
+
+    async def call_and_tee(self, scope: Scope, receive: Receive, send: Send,
+                           prepare: Callable[[int, bytes], dict], if_none_match: str | None = None) -> tuple[int, dict, bytes]:
+        """ run the request through the app, forward every message to the client and keep the body chunks
+        prepare(status_code, body) return the cache headers, when the body come in one message (JSONResponse)
+        they are added before the headers go out, and a matching If-None-Match get a 304 instead
+        return (status_code, headers, body)
+        """
+        result = {'status': 500, 'headers': {}}
+        chunks: list[bytes] = []
+        held: Message | None = None  # response start, held until the first body message
+        started = False
+        prepared = False
+        modified = True
+
+        async def send_tee(message: Message) -> None:
+            nonlocal held, started, prepared, modified
+            if message['type'] == 'http.response.start':
+                held = message
+                result['status'] = message['status']
+                result['headers'] = {k.decode('latin-1'): v.decode('latin-1') for k, v in message.get('headers', [])}
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+            chunk = message.get('body', b'')
+            if chunk:
+                chunks.append(chunk)
+            if held is not None:
+                start, held = held, None
+                raw_headers = list(start.get('headers', []))
+                if not message.get('more_body', False):
+                    # whole body known before the headers are sent
+                    prepared = True
+                    extra = prepare(result['status'], chunk)
+                    result['headers'].update(extra)
+                    if extra and result['status'] == 200 and not_modified(if_none_match, extra.get('etag')):
+                        modified = False
+                        started = True
+                        await send_response(send, 304, {k: v for k, v in result['headers'].items() if k in CACHE_HEADERS})
+                        return
+                    raw_headers += [(k.encode('latin-1'), v.encode('latin-1')) for k, v in extra.items()]
+                started = True
+                await send({**start, 'headers': raw_headers})
+            if modified:
+                await send(message)
+
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_tee)
         except Exception as e:
+            if started:
+                raise
             print(e)
-            response = Response(f"ERROR: Exception {str(type(e))}", status_code=500)
-        # in case of error
-        if response.status_code!=200:
-            return response
-        
-        # set cache
-        if cache_type is not None:
-            response_body = b""
-            async for chunk in response.body_iterator:
-                response_body += chunk
-            # do not cache empty or short response
-            if len(response_body) > 5 and self.set_cache_data(cache_key, response_body, cache_type):
-                print("Cache set", path)
-            else:
-                print("Failed to set cache")
-            return Response(
-                content=response_body,
-                status_code=response.status_code,
-                headers=dict(response.headers), 
-                media_type= "application/json" if response.media_type is None else response.media_type
+            error = f"ERROR: Exception {str(type(e))}".encode()
+            await send_response(send, 500, {}, error)
+            return 500, dict(JSON_HEADERS), error
+        body = b''.join(chunks)
+        if not prepared:
+            # streamed in several messages, the headers are already sent without the cache headers
+            result['headers'].update(prepare(result['status'], body))
+        if 'content-type' not in result['headers']:
+            result['headers'].update(JSON_HEADERS)
+        return result['status'], result['headers'], body
+
+    async def render(self, scope: Scope, body: bytes, prepare: Callable[[int, bytes], dict]) -> tuple[int, dict, bytes]:
+        """ run a copy of a request through the app without a client, used to refresh in background
+        """
+        scope = dict(scope)
+        result = {'status': 500, 'headers': {}}
+        chunks: list[bytes] = []
+
+        async def send(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                result['status'] = message['status']
+                result['headers'] = {k.decode('latin-1'): v.decode('latin-1') for k, v in message.get('headers', [])}
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.app(scope, replay(body), send)
+        body = b''.join(chunks)
+        result['headers'].update(prepare(result['status'], body))
+        return result['status'], result['headers'], body
+
+    def refresh_in_background(self, scope: Scope, body: bytes, cache_key: str, route_key: str, cache_type: str) -> None:
+        async def refresh():
+            try:
+                await single_flight.do(
+                    'refresh:' + cache_key,
+                    lambda: self.fetch_and_cache(cache_key, route_key, cache_type, lambda prepare: self.render(scope, body, prepare), wait=False)
                 )
-        return response
+            except Exception as e:
+                print("Failed to refresh cache", e)
 
-    def redis_connect(self) -> Redis | None:
-        rc = Redis(connection_pool=self.pool)
+        if single_flight.is_running('refresh:' + cache_key):
+            return
+        task = asyncio.create_task(refresh())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def fetch_and_cache(self, cache_key: str, route_key: str, cache_type: str,
+                              compute: Callable[[Callable[[int, bytes], dict]], Awaitable[tuple[int, dict, bytes]]],
+                              wait: bool = True) -> tuple[int, dict, bytes] | None:
+        """ compute the response and cache it, return (status_code, headers, body)
+        compute(prepare) call prepare(status_code, body) as soon as the body is complete, it return the cache headers
+        across workers only the lease holder compute, the others wait for its result
+        wait: False -> return None at once if another worker hold the lease (background refresh)
+        """
+        token = None
         try:
-            if rc.ping():
-                print("Connected to Redis")
-                return rc
-            else:
-                print("Failed to connect to Redis")
+            token = await breaker.call(lambda: self.lease.acquire(cache_key))
+            leased = token is not None
+        except RedisUnavailable:
+            leased = True
+        except Exception as e:  # redis unavailable -> every worker compute by itself
+            print("Failed to get cache lease", e)
+            leased = True
+        if not leased:
+            if not wait:
                 return None
-        except Exception as e:
-            print("Failed to connect to Redis", e)
-            return None
+            entry = await self.wait_for_cache(cache_key)
+            if entry is not None:
+                headers = self.cache_headers(entry, entry_cache_type(entry, route_key, cache_type), time.time())
+                return entry.status, {**JSON_HEADERS, **headers}, entry.plain_body()
+            # the lease holder is too slow or failed, compute by ourselves
 
-    def get_key(self,method: str, path: str, param: str) -> str:
-        """ get cache name with rule 
+        try:
+            start = time.time()
+            entry = None
+
+            def prepare(status_code: int, data: bytes) -> dict:
+                nonlocal entry
+                entry_type, negative = cache_type, False
+                negative_type = get_negative_cache_type(route_key)
+                if negative_type is not None and is_negative_result(status_code, data):
+                    # unknown symbol or no data: cached shortly so repeated misses do not reach the db
+                    entry_type, negative = negative_type, True
+                # in case of error, do not cache empty or short response
+                elif status_code != 200 or len(data) <= 5:
+                    return {}
+                # tag the entry with the tables it is read from, negative entries are invalidated the same way
+                entry = self.build_entry(data, entry_type, time.time() - start, get_cache_tables(route_key),
+                                         status_code, negative)
+                return self.cache_headers(entry, entry_type, time.time())
+
+            status_code, headers, response_body = await compute(prepare)
+            if entry is None:
+                return status_code, headers, response_body
+
+            # set cache, after the response went out
+            # compress once here, hits send the compressed bytes as is
+            entry.body, entry.encoding = compress(response_body, settings.CACHE_COMPRESSION)
+            ok = await self.set_cache_data(cache_key, entry, route_key)
+            cache_stats.record_set(route_key, len(response_body), len(entry.body), ok)
+            if ok:
+                print("Cache set", cache_key)
+            else:
+                print("Failed to set cache")
+            return status_code, headers, response_body
+        finally:
+            if token is not None:
+                try:
+                    await breaker.call(lambda: self.lease.release(cache_key, token))
+                except Exception as e:  # lease expire by itself
+                    print("Failed to release cache lease", e)
+
+    async def wait_for_cache(self, cache_key: str) -> CacheEntry | None:
+        """ wait a short time for another worker to fill the cache, if it is too slow return the stale value
+        while its policy allow serving it (stale-while-revalidate window), else None and the caller compute
         """
-        method = method.lower().strip()
-        path = path.strip().strip('/')
-        param = param.strip()
-        # print(param)
-        # key = self.context.hash(f"{method}:{path}:{param}")
-        return f"{method}:{path}:{param}"
-
-    def set_cache_data(self, cache_key:str, data: str, cache_type: str='in-5m') -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.CACHE_LEASE_WAIT
+        while loop.time() < deadline:
+            await asyncio.sleep(0.05)
+            entry = await self.get_cache_data(cache_key)
+            if entry is not None and entry.is_fresh(time.time()):
+                return entry
+        # L1 keep expired entries until they are evicted, they may be of any age
+        entry = local_cache.get_stale(cache_key)
+        return entry if entry is not None and entry.is_servable(time.time()) else None
+
+    def build_entry(self, data: bytes, cache_type: str='in-5m', delta: float = 0, tables: tuple = (),
+                    status: int = 200, negative: bool = False) -> CacheEntry:
+        # at-time deadlines are computed on every write
+        fresh_until = get_expire_at(cache_type)
+        # stale-while-revalidate policies keep the entry `stale` secs after it expire
+        stale_until = fresh_until + CACHE_TYPE[cache_type].get('stale', 0) if fresh_until is not None else None
+        # plain body, compressed by the caller once the response is sent
+        return CacheEntry(body=data, fresh_until=fresh_until, stale_until=stale_until, delta=delta,
+                          etag=make_etag(data), tags=tuple(tables), status=status, negative=negative)
+
+    async def set_cache_data(self, cache_key:str, entry: CacheEntry, route_key: str | None = None) -> bool:
         # if method == 'GET': # process post body and get query , header, cookie, ... into cache name
         # todo: chose get string | dict | ...
-        rc = self.redis_connect()
-        if rc is None:  # failed to connect to redis
+        stale_until = entry.stale_until
+        # L1 keep the same expire time as redis (L2)
+        local_cache.set(cache_key, entry, stale_until, size=len(entry.body), tags=entry.tags)
+        try:
+            # value and expiry go out in one command: SET key value EXAT ts
+            # with the key added to the tag set of each table in the same round trip
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(cache_key, entry.dumps(), exat=int(stale_until) + 1 if stale_until else None)
+            for table in entry.tags:
+                pipe.sadd(tag_key(table), cache_key)
+                pipe.expire(tag_key(table), TAG_TTL)
+            if route_key is not None:
+                # live keys of the route, for the cache stats
+                pipe.zadd(route_keys_key(route_key), {cache_key: stale_until or '+inf'})
+                pipe.expire(route_keys_key(route_key), TAG_TTL)
+            await breaker.call(pipe.execute)
+        except RedisUnavailable:  # redis is down, keep the entry in L1 only
+            return False
+        except Exception as e:  # failed to connect to redis or redis is too slow
+            print("Failed to set cache", e)
             return False
-        rc.set(cache_key, data)
-        if CACHE_TYPE[cache_type]['type'] == 'duration':
-            rc.expire(cache_key, CACHE_TYPE[cache_type]['ttl'])
-        elif CACHE_TYPE[cache_type]['type'] == 'at-time':
-            rc.expireat(cache_key, CACHE_TYPE[cache_type]['ttl'])
-        rc.close()
         return True
-        
-    def get_cache_data(self, cache_key: str) -> str | None:
-        rc = self.redis_connect()
-        if rc is None:  # failed to connect to redis
+
+    async def get_cache_data(self, cache_key: str) -> CacheEntry | None:
+        # L1: in-process memory
+        entry = local_cache.get(cache_key)
+        if entry is not None:
+            return entry
+        # L2: redis
+        try:
+            # bounded wait, a slow redis only costs this request a short timeout
+            result = await breaker.call(lambda: self.redis.get(cache_key))
+        except RedisUnavailable:  # redis is down, go to the db at once
+            return None
+        except Exception as e:  # failed to connect to redis or redis is too slow
+            print("Failed to get cache", e)
             return None
         # todo: chose set string | dict | ...
-        result = rc.get(cache_key)
-        rc.close()
-        if result is not None and str(result).strip() != '':
-            return result
+        entry = CacheEntry.loads(result) if result else None
+        # a negative entry (404 / empty result) may have an empty body, it is still a hit
+        if entry is not None and (entry.negative or entry.body.strip() != b''):
+            # the entry carry its own expire time, no need to ask redis for the ttl
+            local_cache.set(cache_key, entry, entry.stale_until, size=len(entry.body), tags=entry.tags)
+            return entry
         else:
             return None
@@ -45,6 +45,18 @@ class CoinPrice(CustormBaseModel):
     @field_validator("price_change")
     def round_pc(cls, v: float) -> float:
         return round(v, 2)
+
+
+class CoinPricesColumnar(CustormBaseModel):
+    """ /coin-prices?layout=columnar: one entry per symbol in every list, list_prices[i][j] is the
+    close of symbols[i] at timestamps[j] (null if the symbol has no bar then)
+    """
+    symbols: List[str] = []
+    prices: List[float | None] = []
+    price_changes: List[float | None] = []
+    timestamps: List[int] = []
+    list_prices: List[List[float | None]] = []
+
     
 class Indicators(CustormBaseModel):
     timestamp: int = 0
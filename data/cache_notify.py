@@ -0,0 +1,23 @@
+import os
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+# same redis as the BE cache
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+# channel the BE listen on, see BE/app/core/cache_invalidation.py
+CACHE_INVALIDATE_CHANNEL = "cache:invalidate"
+
+
+def notify_table_updated(*tables):
+    """ tell the BE that new rows landed in the tables, it drop the cached responses built from them
+    a failure here never break the writer, the cache expire by its ttl anyway
+    """
+    try:
+        rc = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=1, socket_timeout=1)
+        for table in tables:
+            # table name without schema, as tagged in the BE
+            rc.publish(CACHE_INVALIDATE_CHANNEL, table.split(".")[-1])
+        rc.close()
+    except Exception as e:
+        print(f"Error publishing cache invalidation for {tables}: {e}")
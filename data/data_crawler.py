@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 import pandas as pd 
+from cache_notify import notify_table_updated
 
 # Load environment variables
 load_dotenv()
@@ -51,6 +52,8 @@ def fetch_prices(symbols=None, start_time=None, end_time=None):
     try:
         data.to_sql(TABLE_NAME, con=engine, if_exists='append', index=False)
         print(f"Data for {symbol} inserted successfully.")
+        # the BE prices routes are tagged with coin_prices (BE/app/core/cache.py), keep both names in sync
+        notify_table_updated(TABLE_NAME)
     except Exception as e:
         print(f"Error inserting data for {symbol}: {e}")
 
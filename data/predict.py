@@ -1,6 +1,7 @@
 import sys
 import pandas as pd
 from config.db import DB
+from cache_notify import notify_table_updated
 from statsmodels.tsa.arima.model import ARIMA
 from sklearn.metrics import mean_squared_error
 from sklearn.metrics import mean_absolute_error
@@ -67,6 +68,7 @@ def main():
     out_df = pd.DataFrame(data=out_data)
     print(engine, out_df)
     out_df.to_sql("coin_predictions", con=engine, if_exists="append", index=False)
+    notify_table_updated("coin_predictions")
 
 
 if __name__ == "__main__":